@@ -0,0 +1,968 @@
+"""
+Benchmarks for the API. Run from the backend folder:
+
+	python bench.py memory
+	python bench.py startup
+	python bench.py db -n 100000
+	python bench.py sql
+	python bench.py load -c 8
+	python bench.py riot -l 20
+	python bench.py routes --sizes 1000,10000,100000
+	python bench.py micro
+	python bench.py decode
+
+Every benchmark prints a JSON document so runs can be saved and compared.
+Save one with -o and check a later run against it with --compare:
+
+	python bench.py routes -o baseline.json
+	python bench.py routes --compare baseline.json
+"""
+
+from argparse import ArgumentParser
+import subprocess
+import shutil
+import threading
+import requests
+import sqlite3
+import time
+import tempfile
+import random
+import json
+import platform
+import sys
+import os
+
+import main
+import fake_riot
+import synthetic
+
+"""
+===============================
+Synthetic Data
+===============================
+"""
+
+def synthetic_player(summoner_id):
+	"""A summoner who's already been classified, so routes don't need the Riot API for them"""
+	summoner = main.Summoner(synthetic.summoner(summoner_id))
+	summoner._highest_rank = random.choice(synthetic.tiers)
+	summoner._classifications = [{
+		"classification": random.choice(["Mage", "Fighter", "Tank", "Assassin", "Support", "Marksman"]),
+		"champions": [{"name": "Annie", "score": 1000, "lanes": [{"lane": random.choice(synthetic.lanes), "count": 1}]}],
+		"score": 1000,
+		"overall_level": 5
+	}]
+	return summoner
+
+def use_synthetic_players(count):
+	"""Points name lookups at a population of synthetic players instead of the Riot API"""
+	players = dict((main.normalize_name(s.name), s) for s in (synthetic_player(i) for i in range(1, count + 1)))
+	main.name_to_summoner = lambda name: players.get(main.normalize_name(name))
+	return players
+
+"""
+===============================
+Memory
+===============================
+"""
+
+class _DictLayout(object):
+	"""Stands in for how the models used to be laid out, a __dict__ per object and the raw JSON kept"""
+	pass
+
+def as_dict_layout(obj, json_obj=None):
+	if isinstance(obj, list):
+		return [as_dict_layout(o) for o in obj]
+	if isinstance(obj, dict):
+		return dict((k, as_dict_layout(v)) for k, v in obj.iteritems())
+	if not isinstance(obj, main.JSONObject):
+		return obj
+
+	legacy = _DictLayout()
+	for cls in type(obj).__mro__:
+		for slot in getattr(cls, "__slots__", ()):
+			if hasattr(obj, slot):
+				setattr(legacy, slot, as_dict_layout(getattr(obj, slot)))
+	legacy.json = json_obj
+	return legacy
+
+def deep_size(obj, seen=None):
+	"""Rough resident size of an object and everything it holds on to"""
+	if seen is None:
+		seen = set()
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+	elif isinstance(obj, (list, tuple, set)):
+		size += sum(deep_size(o, seen) for o in obj)
+	if hasattr(obj, "__dict__"):
+		size += deep_size(obj.__dict__, seen)
+	for cls in type(obj).__mro__:
+		for slot in getattr(cls, "__slots__", ()):
+			if hasattr(obj, slot):
+				size += deep_size(getattr(obj, slot), seen)
+	return size
+
+def bench_memory(options):
+	champions = synthetic.load_champions()
+	champion_ids = [c["id"] for c in champions]
+	count = options.count
+
+	payloads = {
+		"Champion": (main.Champion, champions),
+		"Summoner": (main.Summoner, [synthetic.summoner(i) for i in range(count)]),
+		"Mastery": (main.Mastery, [synthetic.mastery(1, random.choice(champion_ids)) for i in range(count)]),
+		"Match": (main.Match, [synthetic.match_reference(i, random.choice(champion_ids)) for i in range(count)]),
+		"MatchData": (main.MatchData, [synthetic.match(i, range(i * 10, i * 10 + 10), random.sample(champion_ids, 10)) for i in range(count)]),
+	}
+
+	results = {}
+	for name, (model, jsons) in sorted(payloads.items()):
+		sizes = {}
+
+		main.keep_json = True
+		objects = [model(json.loads(json.dumps(j))) for j in jsons]
+		sizes["dict_layout_with_json"] = sum(deep_size(as_dict_layout(o, o.json)) for o in objects) / len(objects)
+		sizes["slots_with_json"] = sum(deep_size(o) for o in objects) / len(objects)
+
+		main.keep_json = False
+		objects = [model(json.loads(json.dumps(j))) for j in jsons]
+		sizes["slots"] = sum(deep_size(o) for o in objects) / len(objects)
+
+		results[name] = sizes
+
+	return results
+
+"""
+===============================
+Startup Time
+===============================
+"""
+
+# Runs in a fresh interpreter so nothing is already imported or loaded
+_startup_script = """
+import os
+# Otherwise importing main loads the artifact before we've picked one
+os.environ["NO_CHAMPION_PRELOAD"] = "1"
+
+import time
+start = time.time()
+import main
+imported = time.time()
+
+from argparse import Namespace
+main.args = Namespace(cache=True)
+main.champions_artifact = {artifact!r}
+main.specific_champion(412)
+done = time.time()
+
+print("%f %f" % ((imported - start) * 1000, (done - imported) * 1000))
+"""
+
+def _median(values):
+	values = sorted(values)
+	return values[len(values) / 2]
+
+def _percentile(values, percent):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+def bench_startup(options):
+	handle, artifact = tempfile.mkstemp(suffix=".bin")
+	os.close(handle)
+	main.compile_champions(target=artifact)
+
+	modes = {
+		"champions_json": os.path.join(tempfile.gettempdir(), "no-such-artifact.bin"),
+		"champions_artifact": artifact,
+	}
+
+	results = {}
+	try:
+		for mode, path in modes.items():
+			imports = []
+			first_lookups = []
+			for _ in range(options.repeat):
+				output = subprocess.check_output([sys.executable, "-c", _startup_script.format(artifact=path)])
+				import_ms, first_lookup_ms = map(float, output.split())
+				imports.append(import_ms)
+				first_lookups.append(first_lookup_ms)
+
+			results[mode] = {
+				"import_ms": _median(imports),
+				"first_lookup_ms": _median(first_lookups)
+			}
+	finally:
+		os.remove(artifact)
+
+	return results
+
+"""
+===============================
+Database
+===============================
+"""
+
+# The queries each route makes, written against the base schema so they
+# can run before and after migrations. Each one gets a random population id.
+route_queries = {
+	"check_for_player": ("SELECT id FROM player WHERE summoner_name = ?", lambda n: ["Summoner {0}".format(random.randint(1, n))]),
+	"leader_teams": ("SELECT team_id FROM players_teams WHERE player_id = ? AND leader = 1", lambda n: [random.randint(1, n)]),
+	"open_request": ("SELECT id FROM player_req WHERE player_id = ? AND finish_time IS NULL", lambda n: [random.randint(1, n)]),
+	"request_player": ("SELECT p.* FROM player p JOIN player_req pr ON pr.player_id = p.id WHERE pr.id = ?", lambda n: [random.randint(1, n)]),
+	"team_members": ("SELECT count(*) FROM players_teams WHERE team_id = ?", lambda n: [random.randint(1, n / 5)]),
+	"open_teams_for_tier": ("SELECT t.* FROM team t JOIN players_teams pt ON pt.team_id = t.id JOIN player p ON p.id = pt.player_id WHERE finish_time IS NULL AND pt.leader = 1 AND p.highest_rank = ?", lambda n: [random.choice(synthetic.tiers)]),
+	"pending_requests": ("""SELECT pr.id, p.id, p.highest_rank, p.best_position FROM player_req pr JOIN player p ON p.id = pr.player_id
+		WHERE pr.finish_time IS NULL AND p.id NOT IN (SELECT player_id FROM players_teams WHERE team_id IN (SELECT id FROM team WHERE finish_time IS NULL))
+		ORDER BY pr.create_time, pr.id""", lambda n: []),
+}
+
+# What SQLiteStorage runs on every route and matchmaking tick. These read
+# the columns the migrations add, so they can only run once they're in.
+storage_queries = {
+	"leading_open_team": ("""SELECT EXISTS (SELECT 1 FROM player p JOIN players_teams pt ON pt.player_id = p.id AND pt.leader = 1
+		JOIN team t ON t.id = pt.team_id WHERE p.summoner_name = ? AND t.finish_time IS NULL)""", lambda n: ["Summoner {0}".format(random.randint(1, n))]),
+	"open_teams": ("""SELECT t.id, t.leader_tier, p.best_position FROM team t JOIN players_teams pt ON pt.team_id = t.id
+		JOIN player p ON p.id = pt.player_id WHERE t.finish_time IS NULL ORDER BY t.id""", lambda n: []),
+	"open_team": ("""SELECT t.id, t.leader_tier, p.best_position FROM team t JOIN players_teams pt ON pt.team_id = t.id
+		JOIN player p ON p.id = pt.player_id WHERE t.finish_time IS NULL AND t.id = ? ORDER BY t.id""", lambda n: [random.randint(1, n / 5)]),
+	"pending_requests": route_queries["pending_requests"],
+}
+
+# The upserts and updates behind add_player, open_request and claim_slots.
+# They're rolled back once they've been timed.
+storage_writes = {
+	"add_player_upsert": ("""INSERT INTO player (summoner_name, highest_rank, best_position, create_time) VALUES (?, ?, ?, ?)
+		ON CONFLICT (summoner_name) DO NOTHING""", lambda n: ["Summoner {0}".format(random.randint(1, n * 2)), "GOLD", "MID Mage", 0]),
+	"open_request_upsert": ("""INSERT INTO player_req (player_id, create_time) VALUES (?, ?)
+		ON CONFLICT (player_id) WHERE finish_time IS NULL DO NOTHING""", lambda n: [random.randint(1, n), 0]),
+	"close_request": ("UPDATE player_req SET team_id = ?, finish_time = ? WHERE id = ? AND finish_time IS NULL", lambda n: [1, 0, random.randint(1, n)]),
+	"claim_team_slot": (main.SQLiteStorage.claim_sql, lambda n: [main.team_size, 0, random.randint(1, n / 5), main.team_size, "MID Mage", "MID Mage"]),
+}
+
+# Indexes the migrations add that nothing needs to be correct. The unique
+# index on open requests stays, open_request_upsert depends on it.
+migration_indexes = ["players_teams_team", "players_teams_player_leader", "player_rank", "player_req_open_created", "team_open", "team_open_tier"]
+
+def load_population(db, count, open_share=0.1):
+	"""Fills a database with count players, count / 5 teams and a request per player"""
+	positions = ["{0} {1}".format(lane, tag) for lane in synthetic.lanes for tag in ["Mage", "Fighter", "Tank", "Assassin", "Support", "Marksman"]]
+	db.executemany("INSERT INTO player (id, summoner_name, highest_rank, best_position, create_time) VALUES (?, ?, ?, ?, ?)",
+		((i, "Summoner {0}".format(i), random.choice(synthetic.tiers), random.choice(positions), i) for i in range(1, count + 1)))
+
+	members = []
+	teams = []
+	player_ids = range(1, count + 1)
+	random.shuffle(player_ids)
+	for team_id in range(1, count / 5 + 1):
+		is_open = random.random() < open_share
+		size = random.randint(1, 4) if is_open else 5
+		teams.append((team_id, team_id, None if is_open else team_id + 60))
+		for idx in range(size):
+			members.append((player_ids[(team_id * 5 + idx) % count], team_id, 1 if idx == 0 else 0))
+	db.executemany("INSERT INTO team (id, create_time, finish_time) VALUES (?, ?, ?)", teams)
+	db.executemany("INSERT INTO players_teams (player_id, team_id, leader) VALUES (?, ?, ?)", members)
+
+	db.executemany("INSERT INTO player_req (id, player_id, create_time, finish_time) VALUES (?, ?, ?, ?)",
+		((i, i, i, None if random.random() < open_share else i + 60) for i in range(1, count + 1)))
+	db.commit()
+
+def time_queries(db, count, repeat, queries=route_queries):
+	results = {}
+	for name, (sql, params) in sorted(queries.items()):
+		plan = [row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + sql, params(count))]
+		start = time.time()
+		for _ in range(repeat):
+			db.execute(sql, params(count)).fetchall()
+		results[name] = {"avg_ms": (time.time() - start) * 1000 / repeat, "plan": plan}
+	return results
+
+def time_writes(db, count, repeat):
+	results = time_queries(db, count, repeat, storage_writes)
+	db.rollback()
+	return results
+
+def time_storage(path, count, repeat):
+	"""Times the storage queries and writes on a migrated database"""
+	db = sqlite3.connect(path)
+	try:
+		results = time_queries(db, count, repeat, storage_queries)
+		results.update(time_writes(db, count, repeat))
+		return results
+	finally:
+		db.close()
+
+def bench_db(options):
+	"""
+	Times the route queries on the base schema and again once it's migrated,
+	then the storage queries and upserts with and without the indexes the
+	migrations add.
+	"""
+	handle, path = tempfile.mkstemp(suffix=".db")
+	os.close(handle)
+	unindexed = path + ".unindexed"
+	main.database_url = path
+
+	results = {}
+	try:
+		db = sqlite3.connect(path)
+		with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")) as f:
+			db.executescript(f.read())
+
+		start = time.time()
+		load_population(db, options.count)
+		results["load_s"] = time.time() - start
+		results["before"] = time_queries(db, options.count, options.repeat)
+
+		start = time.time()
+		main.migrate_db()
+		results["migrate_s"] = time.time() - start
+
+		# Fresh connection so the planner sees the new schema
+		db.close()
+		db = sqlite3.connect(path)
+		results["after"] = time_queries(db, options.count, options.repeat)
+		db.close()
+
+		# The storage queries need the migrated columns, so their baseline is
+		# the same data with the migrations' indexes dropped again. The pool
+		# runs in WAL mode, so everything goes into the file before it's copied.
+		db = sqlite3.connect(path)
+		db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+		db.close()
+		shutil.copyfile(path, unindexed)
+		db = sqlite3.connect(unindexed)
+		for index in migration_indexes:
+			db.execute("DROP INDEX {0}".format(index))
+		db.commit()
+		db.close()
+		results["storage_before"] = time_storage(unindexed, options.count, options.repeat)
+		results["storage_after"] = time_storage(path, options.count, options.repeat)
+	finally:
+		os.remove(path)
+		if os.path.exists(unindexed):
+			os.remove(unindexed)
+
+	return results
+
+class CountingCursor(object):
+	def __init__(self, cursor, counts):
+		self._cursor = cursor
+		self._counts = counts
+
+	def execute(self, *args):
+		self._counts["statements"] += 1
+		return self._cursor.execute(*args)
+
+	def executemany(self, *args):
+		self._counts["statements"] += 1
+		return self._cursor.executemany(*args)
+
+	def __getattr__(self, name):
+		return getattr(self._cursor, name)
+
+class CountingConnection(CountingCursor):
+	"""Wraps a connection to count the statements and commits that go through it"""
+	def cursor(self):
+		return CountingCursor(self._cursor.cursor(), self._counts)
+
+	def commit(self):
+		self._counts["commits"] += 1
+		return self._cursor.commit()
+
+def route_scenarios(count):
+	"""The team routes in order: first time through everyone is new, second time they're already known"""
+	return [
+		("makeateam_new_player", "/api/makeateam/Summoner {0}", range(1, count + 1)),
+		("makeateam_already_searching", "/api/makeateam/Summoner {0}", range(1, count + 1)),
+		("joinateam_new_player", "/api/joinateam/Summoner {0}", range(count + 1, count * 3 + 1)),
+		("joinateam_returning_player", "/api/joinateam/Summoner {0}", range(count + 1, count * 3 + 1)),
+	]
+
+def bench_sql(options):
+	handle, path = tempfile.mkstemp(suffix=".db")
+	os.close(handle)
+	main.database_url = path
+	main.init_db()
+
+	counts = {"statements": 0, "commits": 0}
+	get_db = main.get_db
+	main.get_db = lambda: CountingConnection(get_db(), counts)
+	use_synthetic_players(options.count * 3)
+	client = main.app.test_client()
+
+	results = {}
+	try:
+		for name, route, ids in route_scenarios(options.count):
+			counts.update(statements=0, commits=0)
+			latencies = []
+			for summoner_id in ids:
+				start = time.time()
+				client.get(route.format(summoner_id))
+				latencies.append((time.time() - start) * 1000)
+			results[name] = {
+				"statements_per_request": float(counts["statements"]) / len(ids),
+				"commits_per_request": float(counts["commits"]) / len(ids),
+				"p50_ms": _median(latencies)
+			}
+	finally:
+		main.get_db = get_db
+		os.remove(path)
+
+	return results
+
+"""
+===============================
+Storage Backends
+===============================
+"""
+
+storage_backends = {
+	"sqlite": main.SQLiteStorage,
+	"memory": main.InMemoryStorage
+}
+
+def bench_storage(options):
+	"""Runs the same route workload and matchmaking tick against each storage backend"""
+	use_synthetic_players(options.count * 4)
+	client = main.app.test_client()
+
+	results = {}
+	for backend, storage_class in sorted(storage_backends.items()):
+		handle, path = tempfile.mkstemp(suffix=".db")
+		os.close(handle)
+		main.database_url = path
+		main.init_db()
+		main.set_storage(storage_class())
+		main._matchmaking_index = None
+
+		try:
+			result = results[backend] = {}
+			for name, route, ids in route_scenarios(options.count):
+				latencies = []
+				start = time.time()
+				for summoner_id in ids:
+					request_start = time.time()
+					client.get(route.format(summoner_id))
+					latencies.append((time.time() - request_start) * 1000)
+				result[name] = {
+					"requests_per_second": len(ids) / (time.time() - start),
+					"p50_ms": _median(latencies),
+					"p95_ms": _percentile(latencies, 95)
+				}
+
+			# Leave everyone without a team waiting and hand out new teams for a tick to fill
+			for summoner_id in range(options.count * 3 + 1, options.count * 4 + 1):
+				client.get("/api/makeateam/Summoner {0}".format(summoner_id))
+			with main.app.app_context():
+				result["matchmaking_tick"] = main.matchmaking_tick()
+		finally:
+			main.set_storage(None)
+			main._matchmaking_index = None
+			os.remove(path)
+
+	return results
+
+"""
+===============================
+Concurrent Load
+===============================
+"""
+
+def bench_load(options):
+	handle, path = tempfile.mkstemp(suffix=".db")
+	os.close(handle)
+	main.database_url = path
+	main.init_db()
+	use_synthetic_players(options.count)
+
+	# Every fifth player starts a team, everyone else looks for one
+	work = ["/api/{0}/Summoner {1}".format("makeateam" if i % 5 == 0 else "joinateam", i) for i in range(1, options.count + 1)]
+	random.shuffle(work)
+	work_lock = threading.Lock()
+	latencies = {"makeateam": [], "joinateam": []}
+	errors = []
+
+	def client():
+		session = requests.Session()
+		while True:
+			with work_lock:
+				if not work:
+					return
+				route = work.pop()
+			start = time.time()
+			response = session.get(base + route)
+			elapsed = (time.time() - start) * 1000
+			with work_lock:
+				latencies[route.split("/")[2]].append(elapsed)
+				if response.status_code != 200:
+					errors.append(response.status_code)
+
+	server, base = synthetic.serve_in_background(main.app)
+	try:
+		start = time.time()
+		clients = [threading.Thread(target=client) for _ in range(options.concurrency)]
+		for c in clients:
+			c.start()
+		for c in clients:
+			c.join()
+		duration = time.time() - start
+	finally:
+		server.shutdown()
+		os.remove(path)
+
+	results = {
+		"concurrency": options.concurrency,
+		"requests_per_second": options.count / duration,
+		"errors": len(errors),
+		"db_pool": main.db_pool().stats()
+	}
+	for route, values in latencies.items():
+		results[route] = {
+			"requests": len(values),
+			"p50_ms": _percentile(values, 50),
+			"p95_ms": _percentile(values, 95),
+			"p99_ms": _percentile(values, 99)
+		}
+	return results
+
+"""
+===============================
+Riot Calls
+===============================
+"""
+
+def bench_riot(options):
+	"""
+	Times the routes for players we've never seen before, so every Riot call
+	they need goes out to a fake Riot server with options.latency ms of lag.
+	"""
+	handle, path = tempfile.mkstemp(suffix=".db")
+	os.close(handle)
+	main.database_url = path
+	main.init_db()
+
+	riot = fake_riot.SyntheticRiot(population=max(1000, options.count * 10), seed=options.seed)
+	riot_server, riot_url = synthetic.serve_in_background(fake_riot.make_app(riot, latency=options.latency / 1000.0))
+	main.base_url = main.static_base_url = riot_url
+	main.rate_limiter = main.RateLimiter({})
+	client = main.app.test_client()
+
+	# Every fourth player starts a team, everyone else looks for one
+	work = [("makeateam" if i % 4 == 0 else "joinateam", i) for i in range(1, options.count + 1)]
+	latencies = {"makeateam": [], "joinateam": []}
+	riot_calls = {"makeateam": 0, "joinateam": 0}
+	issued = lambda: sum(v["issued"] for k, v in main.in_flight.stats().items() if k != "in_flight")
+
+	try:
+		# The static champion data only gets loaded once, so get it out of the way
+		main.champion_index()
+		start = time.time()
+		for route, summoner_id in work:
+			calls = issued()
+			request_start = time.time()
+			client.get("/api/{0}/Summoner {1}".format(route, summoner_id))
+			latencies[route].append((time.time() - request_start) * 1000)
+			riot_calls[route] += issued() - calls
+		duration = time.time() - start
+	finally:
+		riot_server.shutdown()
+		os.remove(path)
+
+	results = {"latency_ms": options.latency, "requests_per_second": len(work) / duration}
+	for route, values in latencies.items():
+		results[route] = {
+			"requests": len(values),
+			"riot_calls_per_request": float(riot_calls[route]) / len(values),
+			"p50_ms": _percentile(values, 50),
+			"p95_ms": _percentile(values, 95),
+			"p99_ms": _percentile(values, 99)
+		}
+	return results
+
+"""
+===============================
+Routes
+===============================
+"""
+
+def load_open_teams(db, players, open_teams):
+	"""
+	Fills a migrated database with players 1..players, open_teams of them
+	leading part-built teams of their own tier and the rest not on any team
+	"""
+	positions = ["{0} {1}".format(lane, tag) for lane in synthetic.lanes for tag in ["Mage", "Fighter", "Tank", "Assassin", "Support", "Marksman"]]
+	rows = []
+	members = []
+	teams = []
+	player_id = 0
+	for team_id in range(1, open_teams + 1):
+		tier = random.choice(synthetic.tiers)
+		size = random.randint(1, 4)
+		teams.append((team_id, team_id, tier, size))
+		for idx in range(size):
+			player_id += 1
+			# Different lanes so the team's members could really be on it together
+			rows.append((player_id, "Summoner {0}".format(player_id), tier, positions[(idx * 6 + random.randint(0, 5)) % len(positions)], player_id))
+			members.append((player_id, team_id, 1 if idx == 0 else 0))
+	for player_id in range(player_id + 1, players + 1):
+		rows.append((player_id, "Summoner {0}".format(player_id), random.choice(synthetic.tiers), random.choice(positions), player_id))
+
+	db.executemany("INSERT INTO player (id, summoner_name, highest_rank, best_position, create_time) VALUES (?, ?, ?, ?, ?)", rows)
+	db.executemany("INSERT INTO team (id, create_time, leader_tier, member_count) VALUES (?, ?, ?, ?)", teams)
+	db.executemany("INSERT INTO players_teams (player_id, team_id, leader) VALUES (?, ?, ?)", members)
+	db.commit()
+
+def route_work(players, count):
+	"""count requests each for makeateam, joinateam and debug, spread over known and new players"""
+	work = []
+	for i in range(count):
+		work.append(("makeateam", players + i + 1))
+		work.append(("joinateam", random.randint(1, players) if i % 2 else players + count + i + 1))
+		work.append(("debug", random.randint(1, players)))
+	random.shuffle(work)
+	return work
+
+def drive(work, send, concurrency):
+	"""Runs the work through send(route, summoner_id) on concurrency threads. Returns latencies per route and the duration."""
+	work = list(work)
+	work_lock = threading.Lock()
+	latencies = dict((route, []) for route, _ in work)
+	errors = []
+
+	def client():
+		session = send()
+		while True:
+			with work_lock:
+				if not work:
+					return
+				route, summoner_id = work.pop()
+			start = time.time()
+			status = session(route, summoner_id)
+			elapsed = (time.time() - start) * 1000
+			with work_lock:
+				latencies[route].append(elapsed)
+				if status != 200:
+					errors.append(status)
+
+	start = time.time()
+	clients = [threading.Thread(target=client) for _ in range(concurrency)]
+	for c in clients:
+		c.start()
+	for c in clients:
+		c.join()
+	return latencies, time.time() - start, len(errors)
+
+def _route_url(route, summoner_id):
+	return "/api/{0}/Summoner {1}".format(route, summoner_id)
+
+def bench_routes(options):
+	"""
+	Drives makeateam, joinateam and debug through the test client and a real
+	threaded server, against databases that already hold more and more
+	players and open teams
+	"""
+	results = {}
+	for size in [int(s) for s in options.sizes.split(",")]:
+		for mode in ("test_client", "server"):
+			random.seed(options.seed)
+			handle, path = tempfile.mkstemp(suffix=".db")
+			os.close(handle)
+			main.database_url = path
+			main.init_db()
+			db = sqlite3.connect(path)
+			load_open_teams(db, size, size / 10)
+			db.close()
+
+			main.set_storage(None)
+			main._matchmaking_index = None
+			use_synthetic_players(size + options.count * 3)
+			work = route_work(size, options.count)
+
+			server = None
+			try:
+				with main.app.app_context():
+					main.matchmaking_index()
+
+				if mode == "test_client":
+					client = main.app.test_client()
+					send = lambda: lambda route, summoner_id: client.get(_route_url(route, summoner_id)).status_code
+					latencies, duration, errors = drive(work, send, 1)
+				else:
+					server, base = synthetic.serve_in_background(main.app)
+					def send():
+						session = requests.Session()
+						return lambda route, summoner_id: session.get(base + _route_url(route, summoner_id)).status_code
+					latencies, duration, errors = drive(work, send, options.concurrency)
+			finally:
+				if server is not None:
+					server.shutdown()
+				main.set_storage(None)
+				main._matchmaking_index = None
+				os.remove(path)
+
+			result = results.setdefault(str(size), {})[mode] = {
+				"open_teams": size / 10,
+				"requests_per_second": len(work) / duration,
+				"errors": errors
+			}
+			for route, values in latencies.items():
+				result[route] = {
+					"p50_ms": _percentile(values, 50),
+					"p95_ms": _percentile(values, 95),
+					"p99_ms": _percentile(values, 99)
+				}
+	return results
+
+"""
+===============================
+Micro
+===============================
+"""
+
+def _time_us(func, count, repeat):
+	"""Best of repeat runs of func() count times, in microseconds per call"""
+	best = None
+	for _ in range(repeat):
+		start = time.time()
+		for _ in range(count):
+			func()
+		elapsed = (time.time() - start) * 1000000 / count
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def bench_micro(options):
+	"""Times the hot functions on their own, with nothing going to the Riot API"""
+	main._champion_index = main.ChampionIndex.from_file()
+	riot = fake_riot.SyntheticRiot(seed=options.seed)
+	results = {}
+
+	match_json = riot.match(1000)
+	results["match_data_init_us"] = _time_us(lambda: main.MatchData(match_json), options.count, options.repeat)
+
+	# Everything a classification needs is already fetched, so this is just the work
+	matches = [main.Match(m) for m in riot.match_list(1)["matches"]]
+	masteries = [main.Mastery(m) for m in riot.masteries(1)]
+	ids = iter(xrange(10 ** 9, 10 ** 10))
+
+	def classify(summoner_id):
+		summoner = main.Summoner(synthetic.summoner(summoner_id))
+		summoner._matches = matches
+		summoner._masteries = masteries
+		return summoner.classifications
+
+	results["classifications_new_player_us"] = _time_us(lambda: classify(next(ids)), options.count, options.repeat)
+	classify(1)
+	results["classifications_returning_player_us"] = _time_us(lambda: classify(1), options.count, options.repeat)
+
+	handle, path = tempfile.mkstemp(suffix=".db")
+	os.close(handle)
+	main.database_url = path
+	main.init_db()
+	main.set_storage(None)
+	players = [synthetic_player(i) for i in range(1, options.count * options.repeat + 2)]
+	try:
+		with main.app.app_context():
+			new_players = iter(players[1:])
+			results["create_or_get_player_new_us"] = _time_us(lambda: main.create_or_get_player(next(new_players)), options.count, options.repeat)
+			results["create_or_get_player_existing_us"] = _time_us(lambda: main.create_or_get_player(players[1]), options.count, options.repeat)
+			main.storage().rollback()
+	finally:
+		os.remove(path)
+
+	return results
+
+"""
+===============================
+Decoding
+===============================
+"""
+
+# What each payload gets decoded with and what's built from it
+decode_targets = {
+	"match": (main.match_shape, main.MatchData),
+	"champions": (main.champion_data_shape, lambda d: main.ChampionIndex.from_json(d["data"].values())),
+}
+
+def decode_fixtures():
+	"""Big payloads for each endpoint we decode, as the bytes the API would send"""
+	champion_ids = [c["id"] for c in synthetic.load_champions()]
+	match = synthetic.match(1, range(1, 11), random.sample(champion_ids, 10))
+	match["timeline"] = synthetic.timeline()
+	with open(main.champions_file) as f:
+		champions = f.read()
+
+	return {
+		"match": json.dumps(match),
+		"champions": champions,
+	}
+
+def _full_json(body):
+	"""Decodes everything, the way requests' Response.json() does"""
+	response = requests.models.Response()
+	response._content = body
+	return response.json()
+
+# Runs in a fresh interpreter so the peak is just the one decode
+_decode_peak_script = """
+import resource
+import json
+import bench
+import main
+
+with open({path!r}) as f:
+	body = f.read()
+shape, build = bench.decode_targets[{payload!r}]
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+build(bench._full_json(body) if {full!r} else main.select_json(body, shape))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+
+def bench_decode(options):
+	"""
+	Decodes large Riot payloads whole and with only the fields the models
+	read, then builds the models from them. Sizes are what the decoded
+	JSON holds on to, peaks are the growth in max RSS doing it once for
+	the payloads big enough to show up.
+	"""
+	main.keep_json = False
+	main._champion_index = main.ChampionIndex.from_file()
+	results = {}
+	for payload, body in sorted(decode_fixtures().items()):
+		shape, build = decode_targets[payload]
+		count = max(1, options.count / 20) if payload == "champions" else options.count
+		results[payload] = {
+			"body_bytes": len(body),
+			"full_us": _time_us(lambda: build(_full_json(body)), count, options.repeat),
+			"selected_us": _time_us(lambda: build(main.select_json(body, shape)), count, options.repeat),
+			"full_decoded_bytes": deep_size(_full_json(body)),
+			"selected_decoded_bytes": deep_size(main.select_json(body, shape)),
+		}
+		# Anything smaller fits in memory the interpreter already has and doesn't move the peak
+		if len(body) < 1024 * 1024:
+			continue
+
+		handle, path = tempfile.mkstemp(suffix=".json")
+		os.close(handle)
+		try:
+			with open(path, "w") as f:
+				f.write(body)
+			for mode in ("full", "selected"):
+				script = _decode_peak_script.format(path=path, payload=payload, full=mode == "full")
+				peaks = [int(subprocess.check_output([sys.executable, "-c", script])) for _ in range(options.repeat)]
+				results[payload][mode + "_peak_kb"] = _median(peaks)
+		finally:
+			os.remove(path)
+
+	return results
+
+"""
+===============================
+Comparing Runs
+===============================
+"""
+
+def _flatten(results, prefix=""):
+	"""Turns nested results into {"a.b.c": number}"""
+	flat = {}
+	for key, value in results.items():
+		name = prefix + str(key)
+		if isinstance(value, dict):
+			flat.update(_flatten(value, name + "."))
+		elif isinstance(value, (int, float)) and not isinstance(value, bool):
+			flat[name] = value
+	return flat
+
+def compare(baseline, results, tolerance):
+	"""
+	Lists what got worse by more than tolerance since the baseline. Times
+	(anything ending _ms, _us or _s) are worse when they go up, throughput
+	is worse when it goes down. Everything else is ignored.
+	"""
+	before = _flatten(baseline)
+	after = _flatten(results)
+	regressions = []
+	for name in sorted(set(before) & set(after)):
+		old, new = before[name], after[name]
+		if not old:
+			continue
+		change = (new - old) / float(old)
+		if name.endswith(("_ms", "_us", "_s")):
+			worse = change > tolerance
+		elif name.endswith("requests_per_second"):
+			worse = -change > tolerance
+		else:
+			continue
+		if worse:
+			regressions.append({"metric": name, "baseline": old, "current": new, "change": change})
+	return regressions
+
+def _git_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=open(os.devnull, "w")).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+"""
+===============================
+Startup
+===============================
+"""
+
+benchmarks = {
+	"memory": bench_memory,
+	"startup": bench_startup,
+	"db": bench_db,
+	"sql": bench_sql,
+	"storage": bench_storage,
+	"load": bench_load,
+	"riot": bench_riot,
+	"routes": bench_routes,
+	"micro": bench_micro,
+	"decode": bench_decode,
+}
+
+def main_bench():
+	parser = ArgumentParser(description="Benchmarks for the i-need-a-team API")
+	parser.add_argument("benchmark", choices=sorted(benchmarks.keys()), help="which benchmark to run")
+	parser.add_argument("-n", "--count", dest="count", type=int, default=200, help="how many objects/requests to use")
+	parser.add_argument("-c", "--concurrency", dest="concurrency", type=int, default=8, help="how many clients to run at once")
+	parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=5, help="how many times to repeat each measurement")
+	parser.add_argument("-l", "--latency", dest="latency", type=float, default=20.0, help="milliseconds the fake Riot server takes to answer")
+	parser.add_argument("-s", "--seed", dest="seed", type=int, default=2016, help="random seed so runs are repeatable")
+	parser.add_argument("--sizes", dest="sizes", default="1000,10000,100000", help="comma separated player counts for the routes benchmark")
+	parser.add_argument("-o", "--output", dest="output", default=None, help="also write the results to this file")
+	parser.add_argument("--compare", dest="compare", default=None, help="a saved run to check these results against")
+	parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.1, help="how much worse than the saved run counts as a regression")
+	options = parser.parse_args()
+
+	random.seed(options.seed)
+	results = benchmarks[options.benchmark](options)
+	run = {
+		"benchmark": options.benchmark,
+		"count": options.count,
+		"options": vars(options),
+		"environment": {"python": platform.python_version(), "platform": platform.platform(), "commit": _git_commit(), "time": int(time.time())},
+		"results": results
+	}
+
+	exit_code = 0
+	if options.compare is not None:
+		with open(options.compare) as f:
+			baseline = json.load(f)
+		run["regressions"] = compare(baseline["results"], results, options.tolerance)
+		exit_code = 1 if run["regressions"] else 0
+
+	output = json.dumps(run, indent=2, sort_keys=True)
+	print(output)
+	if options.output is not None:
+		with open(options.output, "w") as f:
+			f.write(output + "\n")
+	sys.exit(exit_code)
+
+if __name__ == '__main__':
+	main_bench()
@@ -0,0 +1,20 @@
+"""
+Compiles cache/champions.json into the slim artifact the API loads at
+startup when running with caching turned on. Run from the backend folder
+whenever champions.json is updated:
+
+	python compile_champions.py
+"""
+
+from argparse import ArgumentParser
+
+import main
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description="Compiles the static champion data for the API")
+	parser.add_argument("-s", "--source", dest="source", default=main.champions_file, help="the champions.json to compile")
+	parser.add_argument("-o", "--output", dest="output", default=main.champions_artifact, help="where to write the compiled artifact")
+	options = parser.parse_args()
+
+	size = main.compile_champions(options.source, options.output)
+	print("Wrote {0} ({1} bytes)".format(options.output, size))
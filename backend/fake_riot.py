@@ -0,0 +1,188 @@
+"""
+A stand-in for the Riot API so the backend can be run and benchmarked
+offline. Serves the summoner, matchlist, match, champion mastery and static
+champion endpoints, either from responses saved with main.py --record or
+from a made up population that's the same every run. Run from the backend
+folder:
+
+	python fake_riot.py --port 5001 --latency 50
+	python main.py -k anything --riot-url http://127.0.0.1:5001
+"""
+
+from argparse import ArgumentParser
+from flask import Flask
+from flask import request
+from flask import Response
+import threading
+import random
+import json
+import time
+import re
+
+import main
+import synthetic
+
+"""
+===============================
+Synthetic Riot
+===============================
+"""
+
+class SyntheticRiot(object):
+	"""
+	Makes up summoners, matches and masteries from their ids. Everything is
+	seeded from what's being asked for, so the answers don't depend on the
+	order requests come in. Each summoner sticks to a small champion pool so
+	classifying them works like it would for a real player.
+	"""
+	def __init__(self, population=5000, matches=10, seed=2016):
+		super(SyntheticRiot, self).__init__()
+		# Matches need ten different summoners
+		self.population = max(10, population)
+		self.matches = matches
+		self.seed = seed
+		self.champions = sorted(c["id"] for c in synthetic.load_champions())
+		with open(main.champions_file) as f:
+			self.champion_data = f.read()
+		self.champions_by_id = dict((c["id"], c) for c in json.loads(self.champion_data)["data"].values())
+		# The synthetic generators use the shared random module
+		self._lock = threading.Lock()
+
+	def _seed(self, *key):
+		random.seed(hash((self.seed,) + key))
+
+	def exists(self, summoner_id):
+		return 1 <= summoner_id <= self.population
+
+	def summoner(self, summoner_id):
+		return synthetic.summoner(summoner_id) if self.exists(summoner_id) else None
+
+	def summoner_id_for(self, name):
+		"""Synthetic summoners are all called "Summoner <id>" """
+		found = re.match(r"^summoner(\d+)$", main.normalize_name(name))
+		return int(found.group(1)) if found else None
+
+	def pool(self, summoner_id):
+		with self._lock:
+			self._seed("pool", summoner_id)
+			return random.sample(self.champions, 5)
+
+	def match_list(self, summoner_id):
+		pool = self.pool(summoner_id)
+		with self._lock:
+			self._seed("matchlist", summoner_id)
+			# Every champion they've got mastery in shows up in their matches
+			matches = [synthetic.match_reference(summoner_id * 1000 + i, pool[i % len(pool)]) for i in range(self.matches)]
+		return {"matches": matches, "startIndex": 0, "endIndex": len(matches), "totalGames": len(matches)}
+
+	def match(self, match_id):
+		"""A match is owned by the summoner whose match list it's in, everyone else is random"""
+		owner, number = divmod(match_id, 1000)
+		if not self.exists(owner) or number >= self.matches:
+			return None
+
+		champion = next(m["champion"] for m in self.match_list(owner)["matches"] if m["matchId"] == match_id)
+		with self._lock:
+			self._seed("match", match_id)
+			others = [i for i in random.sample(xrange(1, self.population + 1), 10) if i != owner][:9]
+			champions = [champion] + random.sample([c for c in self.champions if c != champion], 9)
+			return synthetic.match(match_id, [owner] + others, champions)
+
+	def masteries(self, summoner_id):
+		pool = self.pool(summoner_id)
+		with self._lock:
+			self._seed("masteries", summoner_id)
+			return [synthetic.mastery(summoner_id, champion) for champion in pool]
+
+"""
+===============================
+Server
+===============================
+"""
+
+def make_app(riot, recordings=None, latency=0.0, jitter=0.0, throttle_every=0, retry_after=1):
+	"""
+	Builds the fake API. Saved responses in recordings win over synthetic
+	ones. Every request waits latency (plus up to jitter) seconds, and every
+	throttle_every'th one gets a 429 to see how the backend copes.
+	"""
+	app = Flask(__name__)
+	saved = main.Recorder(recordings, replay=True) if recordings is not None else None
+	counter = {"requests": 0}
+	counter_lock = threading.Lock()
+
+	def respond(value):
+		if value is None:
+			return Response(json.dumps({"status": {"message": "Not Found", "status_code": 404}}), status=404, mimetype="application/json")
+		return Response(json.dumps(value), mimetype="application/json")
+
+	@app.before_request
+	def shape_traffic():
+		if latency or jitter:
+			time.sleep(latency + random.random() * jitter)
+
+		with counter_lock:
+			counter["requests"] += 1
+			throttled = throttle_every and counter["requests"] % throttle_every == 0
+		if throttled:
+			return Response(json.dumps({"status": {"message": "Rate limit exceeded", "status_code": 429}}), status=429,
+				headers={"Retry-After": str(retry_after)}, mimetype="application/json")
+
+		if saved is not None:
+			response = saved.load(request.url)
+			if response is not None:
+				return Response(response.content, status=response.status_code, headers=response.headers)
+
+	@app.route("/api/lol/<region>/v1.4/summoner/by-name/<names>")
+	def summoners_by_name(region, names):
+		found = {}
+		for name in names.split(","):
+			summoner = riot.summoner(riot.summoner_id_for(name) or 0)
+			if summoner is not None:
+				found[main.normalize_name(name)] = summoner
+		return respond(found or None)
+
+	@app.route("/api/lol/<region>/v1.4/summoner/<ids>")
+	def summoners_by_id(region, ids):
+		found = dict((key, riot.summoner(int(key))) for key in ids.split(",") if riot.exists(int(key)))
+		return respond(found or None)
+
+	@app.route("/api/lol/<region>/v2.2/matchlist/by-summoner/<int:summoner_id>")
+	def match_list(region, summoner_id):
+		return respond(riot.match_list(summoner_id) if riot.exists(summoner_id) else None)
+
+	@app.route("/api/lol/<region>/v2.2/match/<int:match_id>")
+	def match(region, match_id):
+		return respond(riot.match(match_id))
+
+	@app.route("/championmastery/location/<platform_id>/player/<int:summoner_id>/champions")
+	def masteries(platform_id, summoner_id):
+		return respond(riot.masteries(summoner_id) if riot.exists(summoner_id) else None)
+
+	@app.route("/api/lol/static-data/<region>/v1.2/champion")
+	def champions(region):
+		return Response(riot.champion_data, mimetype="application/json")
+
+	@app.route("/api/lol/static-data/<region>/v1.2/champion/<int:champion_id>")
+	def champion(region, champion_id):
+		return respond(riot.champions_by_id.get(champion_id))
+
+	return app
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description="Fake Riot API for running the backend offline")
+	parser.add_argument("--port", dest="port", type=int, default=5001, help="port to serve on")
+	parser.add_argument("--population", dest="population", type=int, default=5000, help="how many summoners exist")
+	parser.add_argument("--matches", dest="matches", type=int, default=10, help="how many matches each summoner has")
+	parser.add_argument("--seed", dest="seed", type=int, default=2016, help="changes the made up world")
+	parser.add_argument("--recordings", dest="recordings", default=None, help="serve responses saved with main.py --record from this folder first")
+	parser.add_argument("--latency", dest="latency", type=float, default=0.0, help="milliseconds to wait before every response")
+	parser.add_argument("--jitter", dest="jitter", type=float, default=0.0, help="up to this many more milliseconds, at random")
+	parser.add_argument("--throttle-every", dest="throttle_every", type=int, default=0, help="answer every nth request with a 429, 0 never does")
+	parser.add_argument("--retry-after", dest="retry_after", type=int, default=1, help="the Retry-After seconds to send with a 429")
+	options = parser.parse_args()
+
+	riot = SyntheticRiot(population=options.population, matches=options.matches, seed=options.seed)
+	app = make_app(riot, recordings=options.recordings, latency=options.latency / 1000.0, jitter=options.jitter / 1000.0,
+		throttle_every=options.throttle_every, retry_after=options.retry_after)
+	app.run(port=options.port, threaded=True)
@@ -3,16 +3,29 @@ from flask import request
 from flask import Response
 from flask import jsonify
 from flask import g
+from flask import url_for
+from flask import stream_with_context
 from flask.ext.cors import CORS
 from werkzeug.contrib.cache import RedisCache
 from argparse import ArgumentParser
 from collections import Counter
 from collections import deque
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import itertools
+import bisect
+import threading
+import Queue
 import sqlite3
 import json
+import hashlib
+import cPickle as pickle
 import urllib
+import urlparse
 import requests
+from requests.adapters import HTTPAdapter
 import sys
+import os
 import datetime
 import time
 
@@ -28,9 +41,24 @@ if __name__ == '__main__':
 	parser.add_argument("-c", "--cache", dest="cache", action="store_true", help="causes the API to cache responses and use local resources")
 	parser.add_argument("-t", "--thread", dest="thread", action="store_true", help="causes Flask to run in threaded mode")
 	parser.add_argument("-k", "--api-key", dest="api_key", default="", help="the Riot API key")
+	parser.add_argument("-w", "--workers", dest="workers", type=int, default=8, help="how many Riot API requests can be in flight at once")
+	parser.add_argument("--pool-size", dest="pool_size", type=int, default=10, help="how many keep-alive connections to hold open per Riot host")
+	parser.add_argument("--timeout", dest="timeout", type=float, default=10.0, help="seconds to wait on the Riot API before giving up")
+	parser.add_argument("--matchmaking-interval", dest="matchmaking_interval", type=float, default=5.0, help="seconds between batch matchmaking runs, 0 turns them off")
+	parser.add_argument("--keep-json", dest="keep_json", action="store_true", help="keeps the raw API JSON around on every model object")
+	parser.add_argument("--profile-workers", dest="profile_workers", type=int, default=4, help="how many threads work out new players' profiles in the background, 0 does it during the request")
+	parser.add_argument("--storage", dest="storage", choices=["sqlite", "memory"], default="sqlite", help="where to keep players, teams and requests")
+	parser.add_argument("--db-pool-size", dest="db_pool_size", type=int, default=16, help="how many SQLite connections to keep open")
+	parser.add_argument("--db-pool-timeout", dest="db_pool_timeout", type=float, default=10.0, help="seconds a request waits for a free SQLite connection before failing")
+	parser.add_argument("--metrics", dest="metrics", action="store_true", help="keeps timings and counts for /api/metrics")
+	parser.add_argument("--riot-url", dest="riot_url", default=None, help="talk to this server instead of the Riot API, like a local fake_riot.py")
+	parser.add_argument("--no-rate-limits", dest="no_rate_limits", action="store_true", help="doesn't hold back on Riot calls, only for use with --riot-url or --replay")
+	parser.add_argument("--record", dest="record", default=None, help="saves every Riot response into this folder")
+	parser.add_argument("--replay", dest="replay", default=None, help="answers Riot calls from responses saved with --record instead of the API")
+	parser.add_argument("--local-cache-size", dest="local_cache_size", type=int, default=10000, help="how many Riot lookups to keep in process memory")
 	args = parser.parse_args()
 
-	if args.api_key == "":
+	if args.api_key == "" and args.replay is None:
 		print("No API key provided. Exiting.")
 		sys.exit(1)
 
@@ -44,15 +72,123 @@ Database Tools
 ===============================
 """
 
+# Applied to every connection when it's opened. WAL lets readers carry on while
+# someone's writing, and NORMAL sync is safe with WAL while skipping most fsyncs.
+db_pragmas = [
+	"PRAGMA journal_mode = WAL",
+	"PRAGMA synchronous = NORMAL",
+	"PRAGMA cache_size = -16000",
+	"PRAGMA mmap_size = 268435456",
+	"PRAGMA busy_timeout = 5000",
+	"PRAGMA temp_store = MEMORY",
+]
+
+class ConnectionPool(object):
+	"""
+	Keeps SQLite connections open between requests so we don't pay to open
+	one (and lose its statement cache) every time. Connections are handed
+	out one request at a time. When they're all in use a request waits up to
+	timeout seconds for one, so a request stuck holding a connection can't
+	hang every other route.
+	"""
+	def __init__(self, path, size, timeout=10.0):
+		super(ConnectionPool, self).__init__()
+		self.path = path
+		self.size = size
+		self.timeout = timeout
+		self._idle = Queue.LifoQueue()
+		self._lock = threading.Lock()
+		self._created = 0
+		self._checkouts = 0
+		self._waits = 0
+		self._wait_time = 0.0
+		self._locked_errors = 0
+		self._timeouts = 0
+
+	def _connect(self):
+		db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, cached_statements=256)
+		db.row_factory = sqlite3.Row
+		for pragma in db_pragmas:
+			db.execute(pragma)
+		return db
+
+	def acquire(self):
+		with self._lock:
+			self._checkouts += 1
+			try:
+				return self._idle.get_nowait()
+			except Queue.Empty:
+				if self._created < self.size:
+					self._created += 1
+					return self._connect()
+
+		start = time.time()
+		try:
+			db = self._idle.get(timeout=self.timeout)
+		except Queue.Empty:
+			db = None
+		with self._lock:
+			self._waits += 1
+			self._wait_time += time.time() - start
+			if db is None:
+				self._timeouts += 1
+		if db is None:
+			print("All {0} connections to {1} were in use for {2}s, giving up on this request.".format(self.size, self.path, self.timeout))
+			raise sqlite3.OperationalError("Timed out waiting for a database connection")
+		return db
+
+	def release(self, db, exception=None):
+		# Whatever the request didn't commit doesn't get to leak into the next one
+		db.rollback()
+		if isinstance(exception, sqlite3.OperationalError) and "locked" in str(exception):
+			with self._lock:
+				self._locked_errors += 1
+		self._idle.put(db)
+
+	def stats(self):
+		with self._lock:
+			return {
+				"size": self.size,
+				"open": self._created,
+				"idle": self._idle.qsize(),
+				"checkouts": self._checkouts,
+				"waits": self._waits,
+				"wait_ms": self._wait_time * 1000,
+				"locked_errors": self._locked_errors,
+				"timeouts": self._timeouts
+			}
+
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+def db_pool():
+	"""Gets the connection pool for the current database"""
+	pool = _db_pools.get(database_url)
+	if pool is None:
+		with _db_pools_lock:
+			pool = _db_pools.get(database_url)
+			if pool is None:
+				pool = _db_pools[database_url] = ConnectionPool(database_url, max(1, get_arg("db_pool_size", default=16)), get_arg("db_pool_timeout", default=10.0))
+	return pool
+
 def get_db():
 	db = getattr(g, '_database', None)
 	if db is None:
-		db = g._database = sqlite3.connect(database_url)
-		db.row_factory = sqlite3.Row
+		g._database_pool = db_pool()
+		db = g._database = g._database_pool.acquire()
 	return db
 
+def execute_db(query, args=(), many=False):
+	"""Runs a statement on this request's connection, timing it if metrics are on"""
+	db = get_db()
+	run = db.executemany if many else db.execute
+	if not metrics.enabled:
+		return run(query, args)
+	with metrics.timer("sql_statement_duration_ms", (("statement", query.split(None, 1)[0].upper()),)):
+		return run(query, args)
+
 def query_db(query, args=(), one=False):
-	cur = get_db().execute(query, args)
+	cur = execute_db(query, args)
 	rv = cur.fetchall()
 	cur.close()
 	return (rv[0] if rv else None) if one else rv
@@ -63,12 +199,748 @@ def init_db():
 		with app.open_resource('schema.sql', mode='r') as f:
 			db.cursor().executescript(f.read())
 		db.commit()
+	migrate_db()
+
+def migrate_db():
+	"""Applies any migrations the database hasn't seen yet, in order"""
+	with app.app_context():
+		db = get_db()
+		version = db.execute('PRAGMA user_version').fetchone()[0]
+		for name in sorted(os.listdir(os.path.join(app.root_path, 'migrations'))):
+			number = int(name.split("_")[0])
+			if number <= version:
+				continue
+
+			# Each migration and its version bump go in together or not at all
+			with app.open_resource(os.path.join('migrations', name), mode='r') as f:
+				db.cursor().executescript("BEGIN;\n{0}\nPRAGMA user_version = {1};\nCOMMIT;".format(f.read(), number))
+			version = number
 
 @app.teardown_appcontext
 def close_connection(exception):
 	db = getattr(g, '_database', None)
 	if db is not None:
-		db.close()
+		g._database_pool.release(db, exception)
+
+"""
+===============================
+Storage
+===============================
+"""
+
+class Storage(object):
+	"""
+	Everything we keep about players, teams and requests. The routes go
+	through this instead of straight to the database so the state can live
+	somewhere other than one SQLite file. Claiming a slot on a team is
+	atomic, so several API processes can share one store. Other writes
+	can be held until commit().
+	"""
+	def find_player(self, summoner_name):
+		"""Gets a player (id, summoner_name, highest_rank, best_position) or None"""
+		raise NotImplementedError()
+
+	def add_player(self, summoner_name, highest_rank, best_position):
+		"""Adds a player unless someone got there first. Returns their id either way."""
+		raise NotImplementedError()
+
+	def add_players(self, players):
+		"""Adds (summoner_name, highest_rank, best_position) players in one go, skipping known ones. Returns how many were new."""
+		added = 0
+		for summoner_name, highest_rank, best_position in players:
+			if self.find_player(summoner_name) is None:
+				self.add_player(summoner_name, highest_rank, best_position)
+				added += 1
+		return added
+
+	def open_request(self, player_id):
+		"""Gets the player's open request id, opening one if they don't have one"""
+		raise NotImplementedError()
+
+	def pending_requests(self):
+		"""
+		Gets every open request (req_id, player_id, highest_rank, best_position),
+		oldest first, leaving out players who are already on an open team.
+		"""
+		raise NotImplementedError()
+
+	def create_team(self, leader_id, tier):
+		"""Creates a team with the player as its leader and returns its id"""
+		raise NotImplementedError()
+
+	def leading_open_team(self, summoner_name):
+		"""Whether the player is leading a team that's still open"""
+		raise NotImplementedError()
+
+	def open_team(self, team_id):
+		"""Gets (tier, [best positions]) for an open team, or None if it's closed"""
+		raise NotImplementedError()
+
+	def open_teams(self):
+		"""Gets (team_id, tier, [best positions]) for every open team, oldest first"""
+		raise NotImplementedError()
+
+	def claim_slots(self, claims):
+		"""
+		Tries to put players on teams. Each claim is (player_id, request_id,
+		team_id, best_position) and only goes through if the request is still
+		open and the team is still open, has room, and doesn't already have
+		someone in that position. Returns True for each claim that went
+		through, False if the team didn't take it and None if the request
+		had already been closed.
+		"""
+		raise NotImplementedError()
+
+	def commit(self):
+		pass
+
+	def rollback(self):
+		pass
+
+class SQLiteStorage(Storage):
+	"""Keeps everything in the SQLite database, through the request's pooled connection"""
+
+	# Counts a new member onto a team, closing it if that fills it up. The
+	# checks happen in the same statement that takes the write lock, so no
+	# other connection can slip someone into the slot in between.
+	claim_sql = '''UPDATE team SET
+		member_count = member_count + 1,
+		finish_time = CASE WHEN member_count + 1 >= ? THEN ? ELSE finish_time END
+		WHERE id = ? AND finish_time IS NULL AND member_count < ?
+		AND (? IS NULL OR NOT EXISTS (
+			SELECT 1 FROM players_teams pt JOIN player p ON p.id = pt.player_id
+			WHERE pt.team_id = team.id AND p.best_position = ?
+		))'''
+
+	def find_player(self, summoner_name):
+		return query_db('''SELECT id, summoner_name, highest_rank, best_position FROM player WHERE summoner_name = ?''', [summoner_name], one=True)
+
+	def add_player(self, summoner_name, highest_rank, best_position):
+		insert_sql = '''INSERT INTO player (summoner_name, highest_rank, best_position, create_time) VALUES (?, ?, ?, ?)
+			ON CONFLICT (summoner_name) DO NOTHING'''
+		cur = execute_db(insert_sql, (summoner_name, highest_rank, best_position, epoch_time()))
+		if cur.rowcount == 1:
+			return cur.lastrowid
+		return self.find_player(summoner_name)["id"]
+
+	def add_players(self, players):
+		insert_sql = '''INSERT INTO player (summoner_name, highest_rank, best_position, create_time) VALUES (?, ?, ?, ?)
+			ON CONFLICT (summoner_name) DO NOTHING'''
+		now = epoch_time()
+		db = get_db()
+		before = db.total_changes
+		execute_db(insert_sql, [(name, rank, position, now) for name, rank, position in players], many=True)
+		return db.total_changes - before
+
+	def open_request(self, player_id):
+		# The unique index on open requests means this only inserts if they don't have one
+		insert_sql = '''INSERT INTO player_req (player_id, create_time) VALUES (?, ?)
+			ON CONFLICT (player_id) WHERE finish_time IS NULL DO NOTHING'''
+		cur = execute_db(insert_sql, (player_id, epoch_time()))
+		if cur.rowcount == 1:
+			return cur.lastrowid
+		return query_db('''SELECT id FROM player_req WHERE player_id = ? AND finish_time IS NULL''', [player_id], one=True)["id"]
+
+	def pending_requests(self):
+		return query_db('''SELECT pr.id AS req_id, p.id AS player_id, p.highest_rank, p.best_position
+			FROM player_req pr
+			JOIN player p ON p.id = pr.player_id
+			WHERE pr.finish_time IS NULL
+			AND p.id NOT IN (SELECT player_id FROM players_teams WHERE team_id IN (SELECT id FROM team WHERE finish_time IS NULL))
+			ORDER BY pr.create_time, pr.id''')
+
+	def create_team(self, leader_id, tier):
+		cur = execute_db('''INSERT INTO team (create_time, leader_tier, member_count) VALUES (?, ?, 1)''', (epoch_time(), tier))
+		team_id = cur.lastrowid
+		execute_db('''INSERT INTO players_teams (player_id, team_id, leader) VALUES (?, ?, 1)''', (leader_id, team_id))
+		return team_id
+
+	def leading_open_team(self, summoner_name):
+		query_sql = '''SELECT EXISTS (
+			SELECT 1 FROM player p
+			JOIN players_teams pt ON pt.player_id = p.id AND pt.leader = 1
+			JOIN team t ON t.id = pt.team_id
+			WHERE p.summoner_name = ? AND t.finish_time IS NULL
+		) AS searching'''
+		return bool(query_db(query_sql, [summoner_name], one=True)["searching"])
+
+	def _open_teams(self, where="", args=()):
+		rows = query_db('''SELECT t.id AS team_id, t.leader_tier AS tier, p.best_position AS position
+			FROM team t
+			JOIN players_teams pt ON pt.team_id = t.id
+			JOIN player p ON p.id = pt.player_id
+			WHERE t.finish_time IS NULL {0}
+			ORDER BY t.id'''.format(where), args)
+
+		teams = OrderedDict()
+		for row in rows:
+			tier, positions = teams.setdefault(row["team_id"], (row["tier"], []))
+			positions.append(row["position"])
+		return [(team_id, tier, positions) for team_id, (tier, positions) in teams.iteritems()]
+
+	def open_team(self, team_id):
+		teams = self._open_teams("AND t.id = ?", [team_id])
+		return teams[0][1:] if teams else None
+
+	def open_teams(self):
+		return self._open_teams()
+
+	def claim_slots(self, claims):
+		now = epoch_time()
+		results = []
+		for player_id, request_id, team_id, best_position in claims:
+			# The request goes first so it can only ever be closed onto one team
+			cur = execute_db('''UPDATE player_req SET team_id = ?, finish_time = ? WHERE id = ? AND finish_time IS NULL''', (team_id, now, request_id))
+			if cur.rowcount != 1:
+				results.append(None)
+				continue
+
+			position = position_key(best_position)
+			cur = execute_db(self.claim_sql, (team_size, now, team_id, team_size, position, position))
+			if cur.rowcount == 1:
+				execute_db('''INSERT INTO players_teams (player_id, team_id) VALUES (?, ?)''', (player_id, team_id))
+			else:
+				# We've held the write lock since closing it, so nobody else has seen that
+				execute_db('''UPDATE player_req SET team_id = NULL, finish_time = NULL WHERE id = ?''', (request_id,))
+			results.append(cur.rowcount == 1)
+		return results
+
+	def commit(self):
+		get_db().commit()
+
+	def rollback(self):
+		get_db().rollback()
+
+class InMemoryStorage(Storage):
+	"""Keeps everything in this process. Meant for tests and benchmarks, it all goes away on restart."""
+	def __init__(self):
+		super(InMemoryStorage, self).__init__()
+		self._lock = threading.RLock()
+		self._ids = itertools.count(1)
+		# id -> player, and summoner name -> id
+		self._players = {}
+		self._player_ids = {}
+		# id -> request, and player id -> their open request's id
+		self._requests = {}
+		self._open_requests = {}
+		# id -> team, open teams in the order they were made, and player id -> open teams they're on
+		self._teams = {}
+		self._open_teams = OrderedDict()
+		self._on_open_teams = {}
+
+	def find_player(self, summoner_name):
+		with self._lock:
+			player_id = self._player_ids.get(summoner_name)
+			return dict(self._players[player_id]) if player_id is not None else None
+
+	def add_player(self, summoner_name, highest_rank, best_position):
+		with self._lock:
+			player_id = self._player_ids.get(summoner_name)
+			if player_id is None:
+				player_id = next(self._ids)
+				self._player_ids[summoner_name] = player_id
+				self._players[player_id] = {"id": player_id, "summoner_name": summoner_name, "highest_rank": highest_rank, "best_position": best_position}
+			return player_id
+
+	def open_request(self, player_id):
+		with self._lock:
+			request_id = self._open_requests.get(player_id)
+			if request_id is None:
+				request_id = next(self._ids)
+				self._requests[request_id] = {"id": request_id, "player_id": player_id, "team_id": None, "create_time": epoch_time(), "finish_time": None}
+				self._open_requests[player_id] = request_id
+			return request_id
+
+	def pending_requests(self):
+		with self._lock:
+			pending = []
+			for request_id in sorted(self._open_requests.values(), key=lambda r: (self._requests[r]["create_time"], r)):
+				player = self._players[self._requests[request_id]["player_id"]]
+				if not self._on_open_teams.get(player["id"]):
+					pending.append({"req_id": request_id, "player_id": player["id"], "highest_rank": player["highest_rank"], "best_position": player["best_position"]})
+			return pending
+
+	def _join(self, team, player_id):
+		team["members"].append(player_id)
+		self._on_open_teams.setdefault(player_id, set()).add(team["id"])
+
+	def create_team(self, leader_id, tier):
+		with self._lock:
+			team_id = next(self._ids)
+			team = self._teams[team_id] = {"id": team_id, "leader_id": leader_id, "tier": tier, "members": [], "create_time": epoch_time(), "finish_time": None}
+			self._open_teams[team_id] = team
+			self._join(team, leader_id)
+			return team_id
+
+	def leading_open_team(self, summoner_name):
+		with self._lock:
+			player_id = self._player_ids.get(summoner_name)
+			return any(team["leader_id"] == player_id for team in self._open_teams.itervalues())
+
+	def _positions(self, team):
+		return [self._players[player_id]["best_position"] for player_id in team["members"]]
+
+	def open_team(self, team_id):
+		with self._lock:
+			team = self._open_teams.get(team_id)
+			return (team["tier"], self._positions(team)) if team is not None else None
+
+	def open_teams(self):
+		with self._lock:
+			return [(team_id, team["tier"], self._positions(team)) for team_id, team in self._open_teams.iteritems()]
+
+	def claim_slots(self, claims):
+		now = epoch_time()
+		results = []
+		with self._lock:
+			for player_id, request_id, team_id, best_position in claims:
+				request = self._requests[request_id]
+				if request["finish_time"] is not None:
+					results.append(None)
+					continue
+
+				team = self._open_teams.get(team_id)
+				position = position_key(best_position)
+				if team is None or len(team["members"]) >= team_size or (position is not None and position in self._positions(team)):
+					results.append(False)
+					continue
+
+				self._join(team, player_id)
+				request["team_id"] = team_id
+				request["finish_time"] = now
+				self._open_requests.pop(request["player_id"], None)
+
+				if len(team["members"]) >= team_size:
+					team["finish_time"] = now
+					del self._open_teams[team_id]
+					for member_id in team["members"]:
+						self._on_open_teams[member_id].discard(team_id)
+				results.append(True)
+		return results
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def storage():
+	"""Gets the storage backend picked with --storage"""
+	global _storage
+	if _storage is None:
+		with _storage_lock:
+			if _storage is None:
+				_storage = InMemoryStorage() if get_arg("storage", default="sqlite") == "memory" else SQLiteStorage()
+	return _storage
+
+def set_storage(backend):
+	global _storage
+	_storage = backend
+
+"""
+===============================
+Rate Limiting
+===============================
+"""
+
+# (requests, seconds) windows for each budget. The app budget is shared by
+# everything except static data, which Riot doesn't count against the key.
+rate_limits = {
+	"app": [(10, 10), (500, 600)],
+	"summoner": [(10, 10)],
+	"matchlist": [(10, 10)],
+	"match": [(10, 10)],
+	"championmastery": [(10, 10)],
+	"static-data": [(10, 1)],
+}
+
+class TokenBucket(object):
+	"""A token bucket that hands out tokens to waiting threads in FIFO order"""
+	def __init__(self, capacity, period):
+		super(TokenBucket, self).__init__()
+		self.capacity = capacity
+		self.period = period
+		self.rate = float(capacity) / period
+		self.tokens = float(capacity)
+		self.updated = time.time()
+		self.blocked_until = 0
+		self.waits = 0
+		self.wait_time = 0.0
+		self.rejections = 0
+		self._cond = threading.Condition()
+		self._queue = deque()
+
+	def _refill(self, now):
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self):
+		"""Blocks until a token is available and it's our turn to take it"""
+		with self._cond:
+			ticket = object()
+			self._queue.append(ticket)
+			waited = False
+			start = time.time()
+			try:
+				while True:
+					now = time.time()
+					self._refill(now)
+					if self._queue[0] is ticket:
+						if now < self.blocked_until:
+							timeout = self.blocked_until - now
+						elif self.tokens >= 1:
+							self.tokens -= 1
+							if waited:
+								self.wait_time += now - start
+							return
+						else:
+							timeout = (1 - self.tokens) / self.rate
+					else:
+						# Somebody is ahead of us, they'll wake us up when they're done
+						timeout = None
+
+					if not waited:
+						self.waits += 1
+						waited = True
+					self._cond.wait(timeout)
+			finally:
+				self._queue.remove(ticket)
+				self._cond.notify_all()
+
+	def back_off(self, seconds):
+		"""Empties the bucket and holds everyone off for the given amount of time"""
+		with self._cond:
+			# Riot turned a call away that this bucket let through
+			self.rejections += 1
+			self.tokens = 0
+			self.updated = time.time()
+			self.blocked_until = max(self.blocked_until, self.updated + seconds)
+			self._cond.notify_all()
+
+	def stats(self):
+		with self._cond:
+			self._refill(time.time())
+			return {
+				"capacity": self.capacity,
+				"period": self.period,
+				"tokens": int(self.tokens),
+				"queued": len(self._queue),
+				"waits": self.waits,
+				"wait_ms": self.wait_time * 1000,
+				"rejections": self.rejections,
+				"blocked_for": max(0, int(self.blocked_until - self.updated))
+			}
+
+class RateLimiter(object):
+	"""Keeps every budget we have with Riot so we stay under it instead of finding out with a 429"""
+	def __init__(self, limits):
+		super(RateLimiter, self).__init__()
+		self.buckets = {}
+		for name, windows in limits.iteritems():
+			self.buckets[name] = [TokenBucket(count, period) for count, period in windows]
+
+	def _buckets_for(self, endpoint):
+		buckets = []
+		if endpoint != "static-data":
+			buckets.extend(self.buckets.get("app", []))
+		buckets.extend(self.buckets.get(endpoint, []))
+		return buckets
+
+	def acquire(self, endpoint):
+		for bucket in self._buckets_for(endpoint):
+			bucket.acquire()
+
+	def back_off(self, endpoint, seconds):
+		for bucket in self._buckets_for(endpoint):
+			bucket.back_off(seconds)
+
+	def stats(self):
+		return dict((name, [b.stats() for b in buckets]) for name, buckets in self.buckets.iteritems())
+
+# Nothing to stay under when we're talking to a fake Riot server
+rate_limiter = RateLimiter({} if args is not None and args.no_rate_limits else rate_limits)
+
+def endpoint_for_url(url):
+	"""Figures out which Riot budget a request URL is charged against"""
+	if "/static-data/" in url:
+		return "static-data"
+	elif "/championmastery/" in url:
+		return "championmastery"
+	elif "/matchlist/" in url:
+		return "matchlist"
+	elif "/match/" in url:
+		return "match"
+	elif "/summoner/" in url:
+		return "summoner"
+	return "app"
+
+"""
+===============================
+HTTP Connections
+===============================
+"""
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def session_for(url):
+	"""Gets the shared keep-alive session for the host the URL points at"""
+	parts = urlparse.urlsplit(url)
+	base = "{0}://{1}".format(parts.scheme, parts.netloc)
+	session = _sessions.get(base)
+	if session is None:
+		with _sessions_lock:
+			session = _sessions.get(base)
+			if session is None:
+				pool_size = get_arg("pool_size", default=10)
+				session = requests.Session()
+				session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+				adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+				session.mount(base, adapter)
+				session.riot_adapter = adapter
+				_sessions[base] = session
+	return session
+
+def connection_stats():
+	"""How many connections we've had to open against how many requests they served, per host"""
+	stats = {}
+	for base, session in _sessions.items():
+		opened = 0
+		served = 0
+		for key in session.riot_adapter.poolmanager.pools.keys():
+			pool = session.riot_adapter.poolmanager.pools.get(key)
+			if pool is not None:
+				opened += pool.num_connections
+				served += pool.num_requests
+		stats[base] = {"connections": opened, "requests": served, "reused": max(0, served - opened)}
+	return stats
+
+def request_key(url):
+	"""The URL with the API key taken out and the query sorted, so identical calls match"""
+	parts = urlparse.urlsplit(url)
+	params = sorted((k, v) for k, v in urlparse.parse_qsl(parts.query) if k != "api_key")
+	return "{0}://{1}{2}?{3}".format(parts.scheme, parts.netloc, parts.path, urllib.urlencode(params))
+
+class InFlightRequests(object):
+	"""
+	Riot calls that are out right now. A thread asking for a URL that's
+	already being fetched waits on that response instead of spending more
+	rate limit on the same thing.
+	"""
+	def __init__(self):
+		super(InFlightRequests, self).__init__()
+		self._flights = {}
+		self._lock = threading.Lock()
+		self._counters = Counter()
+
+	def fetch(self, url, fetch):
+		"""Calls fetch(url) unless the same request is already out, in which case it waits for that one"""
+		key = request_key(url)
+		endpoint = endpoint_for_url(url)
+		with self._lock:
+			flight = self._flights.get(key)
+			leader = flight is None
+			if leader:
+				flight = self._flights[key] = _Flight()
+				self._counters[(endpoint, "issued")] += 1
+			else:
+				self._counters[(endpoint, "coalesced")] += 1
+
+		if not leader:
+			flight.done.wait()
+			if flight.error is not None:
+				raise flight.error
+			return flight.value
+
+		try:
+			flight.value = fetch(url)
+			return flight.value
+		except Exception as e:
+			flight.error = e
+			raise
+		finally:
+			with self._lock:
+				del self._flights[key]
+			flight.done.set()
+
+	def stats(self):
+		with self._lock:
+			stats = {}
+			for (endpoint, counter), count in self._counters.iteritems():
+				stats.setdefault(endpoint, {"issued": 0, "coalesced": 0})[counter] = count
+			stats["in_flight"] = len(self._flights)
+		return stats
+
+in_flight = InFlightRequests()
+
+"""
+===============================
+Recording
+===============================
+"""
+
+def recording_key(url):
+	"""What a response is saved under, the path and query without the host or API key"""
+	parts = urlparse.urlsplit(request_key(url))
+	return "{0}?{1}".format(parts.path, parts.query)
+
+class RecordedResponse(object):
+	"""Enough of a requests.Response for everything here to use a saved one"""
+	def __init__(self, status_code, headers, content):
+		super(RecordedResponse, self).__init__()
+		self.status_code = status_code
+		self.headers = headers
+		self.content = content
+
+	@property
+	def text(self):
+		return self.content.decode("utf-8")
+
+	def json(self):
+		return json.loads(self.content)
+
+class Recorder(object):
+	"""
+	Saves Riot responses to a folder, one JSON file each, or plays them back
+	so runs are repeatable and don't need the real API. fake_riot.py can
+	serve the same folder.
+	"""
+	def __init__(self, folder, replay=False):
+		super(Recorder, self).__init__()
+		self.folder = folder
+		self.replay = replay
+		if not replay and not os.path.isdir(folder):
+			os.makedirs(folder)
+
+	def path_for(self, url):
+		return os.path.join(self.folder, hashlib.md5(recording_key(url)).hexdigest() + ".json")
+
+	def load(self, url):
+		"""Gets the saved response for a URL, or None if there isn't one"""
+		path = self.path_for(url)
+		if not os.path.exists(path):
+			return None
+		with open(path) as f:
+			saved = json.load(f)
+		return RecordedResponse(saved["status"], saved["headers"], saved["body"].encode("utf-8"))
+
+	def save(self, url, response):
+		saved = {
+			"key": recording_key(url),
+			"status": response.status_code,
+			"headers": dict((k, v) for k, v in response.headers.items() if k.lower() in ("content-type", "retry-after")),
+			"body": response.content.decode("utf-8")
+		}
+		with open(self.path_for(url), "w") as f:
+			json.dump(saved, f)
+
+recorder = None
+
+def use_recorder(new_recorder):
+	global recorder
+	recorder = new_recorder
+
+"""
+===============================
+Selective JSON
+===============================
+"""
+
+# A shape says which parts of a JSON document to keep. True keeps a value
+# as it is, {key: shape} keeps only those keys of an object ("*" matches any
+# key), a frozenset of keys keeps only those keys as they are and [shape]
+# applies a shape to every item of an array. The document
+# itself and "*" objects are walked a value at a time, everything under
+# them is decoded whole by the C scanner and trimmed straight away. That's
+# quicker than walking it all and only ever holds one of those values.
+_json_decoder = json.JSONDecoder()
+_json_whitespace = json.decoder.WHITESPACE.match
+
+def _skip_whitespace(s, idx):
+	return _json_whitespace(s, idx).end()
+
+def _scan_json(s, idx):
+	try:
+		return _json_decoder.scan_once(s, idx)
+	except StopIteration:
+		raise ValueError("No JSON value at {0}".format(idx))
+
+def _pick_json(value, shape):
+	"""Does what _select_json does, to a value that's already decoded"""
+	if isinstance(shape, dict) and isinstance(value, dict):
+		if "*" in shape:
+			anything = shape["*"]
+			return dict((key, _pick_json(item, shape.get(key, anything))) for key, item in value.iteritems() if shape.get(key, anything) is not None)
+		# It's only just been decoded so it's ours to trim
+		for key in value.viewkeys() - shape.viewkeys():
+			del value[key]
+		for key, wanted in shape.iteritems():
+			if wanted is not True and key in value:
+				value[key] = _pick_json(value[key], wanted)
+		return value
+	if isinstance(shape, frozenset) and isinstance(value, dict):
+		for key in value.viewkeys() - shape:
+			del value[key]
+		return value
+	if isinstance(shape, list) and isinstance(value, list):
+		return [_pick_json(item, shape[0]) for item in value]
+	return value
+
+def _select_json(s, idx, shape):
+	char = s[idx:idx + 1]
+	if isinstance(shape, dict) and "*" in shape and char == "{":
+		return _select_object(s, idx + 1, shape)
+	value, idx = _scan_json(s, idx)
+	return _pick_json(value, shape), idx
+
+def _select_object(s, idx, shape):
+	selected = {}
+	anything = shape.get("*")
+	idx = _skip_whitespace(s, idx)
+	if s[idx:idx + 1] == "}":
+		return selected, idx + 1
+
+	while True:
+		if s[idx:idx + 1] != '"':
+			raise ValueError("Expecting property name at {0}".format(idx))
+		key, idx = json.decoder.scanstring(s, idx + 1, "utf-8", True)
+		idx = _skip_whitespace(s, idx)
+		if s[idx:idx + 1] != ":":
+			raise ValueError("Expecting : at {0}".format(idx))
+		idx = _skip_whitespace(s, idx + 1)
+
+		wanted = shape.get(key, anything)
+		if wanted is None:
+			# Still has to be read past, but it's gone as soon as it's parsed
+			_, idx = _scan_json(s, idx)
+		else:
+			selected[key], idx = _select_json(s, idx, wanted)
+
+		idx = _skip_whitespace(s, idx)
+		char = s[idx:idx + 1]
+		if char == "}":
+			return selected, idx + 1
+		if char != ",":
+			raise ValueError("Expecting , or }} at {0}".format(idx))
+		idx = _skip_whitespace(s, idx + 1)
+
+def select_json(s, shape):
+	"""
+	Decodes only the parts of a JSON document that shape asks for. The rest
+	is read past a value at a time, so the whole document is never in
+	memory as Python objects at once.
+	"""
+	idx = _skip_whitespace(s, 0)
+	if isinstance(shape, dict) and s[idx:idx + 1] == "{":
+		value, idx = _select_object(s, idx + 1, shape)
+	else:
+		value, idx = _select_json(s, idx, shape)
+	if _skip_whitespace(s, idx) != len(s):
+		raise ValueError("Extra data at {0}".format(idx))
+	return value
+
+def response_json(response, shape):
+	"""Decodes what the models need from a Riot response, or all of it if we're keeping the raw JSON"""
+	if keep_json:
+		return response.json()
+	return select_json(response.content, shape)
 
 """
 ===============================
@@ -83,8 +955,9 @@ def get_arg(arg, default=False):
 	return vars(args)[arg]
 
 api_key = get_arg("api_key", default="")
-base_url = "https://na.api.pvp.net"
-static_base_url = "https://global.api.pvp.net"
+keep_json = get_arg("keep_json", default=False)
+base_url = get_arg("riot_url", default=None) or "https://na.api.pvp.net"
+static_base_url = get_arg("riot_url", default=None) or "https://global.api.pvp.net"
 database_url = './database.db'
 
 def set_api_key(key):
@@ -129,7 +1002,7 @@ def summoner_by_name(summoner_names, region="NA"):
 	)
 
 def summoners_by_id(summoner_ids, region="NA"):
-	return "//api/lol/{region}/v1.4/summoner/{summonerIds}".format(
+	return "/api/lol/{region}/v1.4/summoner/{summonerIds}".format(
 		region=region,
 		summonerIds=summoner_ids
 	)
@@ -166,86 +1039,151 @@ def normalize_name(name):
 	return name.replace(" ", "").lower().encode("utf-8")
 
 def get_request(url):
-	data = requests.get(url)
+	# Identical calls that are already out get shared rather than sent again
+	return in_flight.fetch(url, fetch_riot)
+
+def fetch_riot(url):
+	"""Gets a Riot response, from the recording if we're replaying one"""
+	if recorder is not None and recorder.replay:
+		response = recorder.load(url)
+		if response is None:
+			raise LookupError("Nothing recorded for {0}".format(recording_key(url)))
+		return response
+
+	response = _get_request(url)
+	if recorder is not None:
+		recorder.save(url, response)
+	return response
 
-	if data.status_code == 429:
-		print("Just hit the rate limit. Look into this.")
-		wait_time = data.headers["Retry-After"]
-		time.sleep(wait_time + 2)
-		return get_request(url)
-	else:
-		return data
+def _get_request(url):
+	endpoint = endpoint_for_url(url)
+	while True:
+		rate_limiter.acquire(endpoint)
+		with metrics.timer("riot_request_duration_ms", (("endpoint", endpoint),)):
+			data = session_for(url).get(url, timeout=get_arg("timeout", default=10.0))
+		metrics.inc("riot_requests_total", (("endpoint", endpoint), ("status", str(data.status_code))))
+
+		if data.status_code != 429:
+			return data
+
+		# We should only get here if someone else is sharing the key or
+		# our budgets are off. Either way hold everyone else off too.
+		print("Just hit the rate limit on {0}. Look into this.".format(endpoint))
+		wait_time = int(data.headers.get("Retry-After", 1))
+		rate_limiter.back_off(endpoint, wait_time + 2)
 
 def all_champions():
-	if not args.cache:
-		champs_data_url = full_url(static_base_url, champ_all(), query_params={"champData": "allytips,enemytips"})
-		champs_data = get_request(champs_data_url).json()["data"]
-		return map(lambda c: Champion(c), champs_data.values())
-	else:
-		return cache.get("champion").values()
+	return list(champion_index().all())
 
 def specific_champion(champion_id):
-	should_cache = get_arg("cache")
-	if not should_cache:
+	champion = champion_index().get(champion_id)
+	if champion is not None:
+		return champion
+
+	# Probably a brand new champion, so go ask for it directly
+	def load():
 		champ_data_url = full_url(static_base_url, champ_specific(champion_id), query_params={"champData": "info,tags"})
 		champ_data = get_request(champ_data_url).json()
 		return Champion(champ_data)
-	else:
-		return cache.get("champ-" + str(champion_id))
+
+	return riot_cache.get_or_load("champion", champion_id, load)
 
 def name_to_summoner(name):
 	normalized = normalize_name(name)
-	cache_key = "summ-" + normalized
-	should_cache = get_arg("cache")
-
-	# Check our cache no matter what
-	if should_cache:
-		cached = cache.get(cache_key)
-		if cached is not None:
-			return cached
-
-	summoner_data_url = full_url(base_url, summoner_by_name(normalized))
-	summoner_data = get_request(summoner_data_url)
-	if summoner_data.status_code == 404:
-		return None
-	summoner = Summoner(summoner_data.json()[normalized])
 
-	if should_cache:
-		cache.set(cache_key, summoner)
+	def load():
+		summoner_data_url = full_url(base_url, summoner_by_name(normalized))
+		summoner_data = get_request(summoner_data_url)
+		if summoner_data.status_code == 404:
+			return None
+		summoner = Summoner(summoner_data.json()[normalized])
+		riot_cache.set("summoner_id", summoner.s_id, normalized)
+		return summoner
+
+	# Unknown names get cached too so nobody can make us hammer the API with them
+	return riot_cache.get_or_load("summoner", normalized, load)
+
+# The most names or ids the summoner endpoints take in one call
+summoner_batch_size = 40
+
+def resolve_summoners(keys, by="name"):
+	"""
+	Looks up lots of summoners at once, by name or by id. Duplicates are
+	dropped, cached summoners don't touch the API, and the rest go out in
+	calls of 40 at the same time. Returns the summoners in the same order
+	as keys, with None for any that don't exist.
+	"""
+	normalize = normalize_name if by == "name" else int
+	kind = "summoner" if by == "name" else "summoner_id"
+	unique = list(OrderedDict.fromkeys(normalize(key) for key in keys))
+
+	if by == "name":
+		found = riot_cache.get_many("summoner", unique)
+	else:
+		# Ids point at names, which point at the summoners
+		names = riot_cache.get_many("summoner_id", unique)
+		summoners = riot_cache.get_many("summoner", [name for name in names.values() if name is not None])
+		found = dict((s_id, summoners[name] if name is not None else None) for s_id, name in names.iteritems() if name is None or name in summoners)
+
+	misses = [key for key in unique if key not in found]
+	riot_cache.count(kind, "misses", len(misses))
+	batches = [misses[i:i + summoner_batch_size] for i in range(0, len(misses), summoner_batch_size)]
+
+	def fetch(batch):
+		path = summoner_by_name if by == "name" else summoners_by_id
+		response = get_request(full_url(base_url, path(",".join(str(key) for key in batch))))
+		# The API 404s when none of them exist
+		return {} if response.status_code == 404 else response.json()
+
+	for batch, response in zip(batches, fan_out(fetch, batches)):
+		for key in batch:
+			summoner_data = response.get(str(key))
+			summoner = Summoner(summoner_data) if summoner_data is not None else None
+			found[key] = summoner
+			if summoner is None:
+				# Remember that it's missing so nobody can make us ask again
+				riot_cache.set(kind, key, None)
+			else:
+				riot_cache.set("summoner", normalize_name(summoner.name), summoner)
+				riot_cache.set("summoner_id", summoner.s_id, normalize_name(summoner.name))
 
-	return summoner
+	return [found[normalize(key)] for key in keys]
 
-def ids_to_summoners(ids):
-	id_list = ",".join(map(lambda i: str(i), ids))
-	should_cache = get_arg("cache")
+def names_to_summoners(names):
+	return resolve_summoners(names, by="name")
 
-	summoners_data_url = full_url(base_url, summoners_by_id(id_list))
-	response = get_request(summoners_data_url).json()
-	summoners = []
-	for summoner_data in response.values():
-		summoner = Summoner(summoner_data)
-		summoners.append(summoner)
-		cache_key = "summ-" + normalize_name(summoner.name)
-		if should_cache:
-			cache.set(cache_key, summoner)
-
-	return summoners
+def ids_to_summoners(ids):
+	"""Gets the summoners for a bunch of ids, leaving out any that don't exist"""
+	return [summoner for summoner in resolve_summoners(ids, by="id") if summoner is not None]
 
 def get_masteries(summoner_id):
 	"""Gets the masteries for the given summoner ID"""
-	mastery_data_url = full_url(base_url, mastery_player_all(summoner_id))
-	return map(lambda m: Mastery(m), get_request(mastery_data_url).json())
+	def load():
+		mastery_data_url = full_url(base_url, mastery_player_all(summoner_id))
+		return map(lambda m: Mastery(m), get_request(mastery_data_url).json())
+
+	return riot_cache.get_or_load("mastery", summoner_id, load)
 
 def get_match_list(summoner_id):
 	"""Gets the match list for the given summoner ID"""
-	match_data_url = full_url(base_url, match_list(summoner_id))
-	data = get_request(match_data_url).json()
-	return map(lambda m: Match(m), data["matches"])
+	def load():
+		match_data_url = full_url(base_url, match_list(summoner_id))
+		response = get_request(match_data_url)
+		# Anyone without ranked games has no match list at all
+		if response.status_code == 404:
+			return []
+		data = response.json()
+		return map(lambda m: Match(m), data.get("matches", []))
+
+	return riot_cache.get_or_load("matchlist", summoner_id, load)
 
 def get_match(match_id):
 	"""Gets the match data for the given match ID"""
-	match_data_url = full_url(base_url, match_specific(match_id))
-	return MatchData(get_request(match_data_url).json())
+	def load():
+		match_data_url = full_url(base_url, match_specific(match_id))
+		return MatchData(response_json(get_request(match_data_url), match_shape))
+
+	return riot_cache.get_or_load("match", match_id, load)
 
 def epoch_time():
 	"""Gets the current epoch time"""
@@ -253,11 +1191,7 @@ def epoch_time():
 
 def check_for_player(summoner):
 	"""Checks if a player exists for the summoner"""
-	db = get_db()
-	cur = db.cursor()
-
-	# Going to check if the player exists already.
-	player = query_db('''SELECT id FROM player WHERE summoner_name = ?''', [summoner.name], one=True)
+	player = storage().find_player(summoner.name)
 
 	if player is None:
 		return False
@@ -265,106 +1199,1298 @@ def check_for_player(summoner):
 		return player["id"]
 
 def create_or_get_player(summoner):
-	"""Creates a player if necessary"""
-	db = get_db()
-	cur = db.cursor()
-
-	# Going to check if the player exists already.
+	"""
+	Creates a player if necessary. Doesn't commit, that's left to whoever
+	is finishing up the request.
+	"""
+	# Going to check if the player exists already. Working out a new
+	# player's position is expensive so we don't want to do it up front.
 	player = check_for_player(summoner)
 
 	if not player:
 		# If the player doesn't exist we're gonna put them in.
-		classification = summoner.classifications[0]
-		best_type = (classification["champions"][0]["lanes"][0]["lane"], classification["classification"])
+		player = storage().add_player(*player_profile(summoner))
 
-		insert_sql = '''INSERT INTO player (id, summoner_name, highest_rank, best_position, create_time) VALUES (NULL, ?, ?, ?, ?)'''
-		cur.execute(insert_sql, (summoner.name, summoner.highest_rank, best_type[0] + " " + best_type[1], epoch_time()))
-		player = cur.lastrowid
-
-	db.commit()
 	return player
 
+def player_profile(summoner):
+	"""Works out (summoner_name, highest_rank, best_position) for a player. This is the expensive part."""
+	classification = summoner.classifications[0]
+	best_type = (classification["champions"][0]["lanes"][0]["lane"], classification["classification"])
+	return summoner.name, summoner.highest_rank, best_type[0] + " " + best_type[1]
+
 def create_player_request(summoner):
-	"""Creates a new team request for a player"""
-	db = get_db()
-	cur = db.cursor()
+	"""
+	Creates a new team request for a player, or gets the one they already
+	have open. Doesn't commit either.
+	"""
+	return storage().open_request(create_or_get_player(summoner))
 
-	player = create_or_get_player(summoner)
+def create_team(summoner):
+	"""Creates a new team with the summoner as its leader"""
+	# This will only create a player if they don't already exist
+	create_or_get_player(summoner)
+	leader = storage().find_player(summoner.name)
 
-	# Check if they have any open reqs out.
-	player_req = query_db('''SELECT id FROM player_req WHERE player_id = ? AND finish_time IS NULL''', [player], one=True)
+	team_id = storage().create_team(leader["id"], leader["highest_rank"])
+	storage().commit()
 
-	if player_req is None:
-		# If they don't have any open reqs then we can create one.
-		insert_sql = '''INSERT INTO player_req (player_id, create_time) VALUES (?, ?)'''
-		cur.execute(insert_sql, (player, epoch_time()))
-		player_req = cur.lastrowid
-	else:
-		player_req = player_req["id"]
+	matchmaking_index().add_team(team_id, leader["highest_rank"], leader["best_position"])
+	return team_id
 
-	db.commit()
-	return player_req
+def join_team(player, player_req_id):
+	"""
+	Puts the player on the best team that'll have them. Returns the team id,
+	or None if nothing fits yet. Doesn't commit.
+	"""
+	index = matchmaking_index()
+	while True:
+		team_id = index.claim_slot(player["highest_rank"], player["best_position"])
+		if team_id is None:
+			return None
+
+		try:
+			joined = storage().claim_slots([(player["id"], player_req_id, team_id, player["best_position"])])[0]
+		except Exception:
+			index.release_slot(team_id, player["best_position"])
+			raise
+
+		if joined:
+			index.settle_slot(team_id)
+			return team_id
+
+		if joined is None:
+			# Matchmaking (or another call for them) already placed this request
+			index.release_slot(team_id, player["best_position"])
+			return None
+
+		# Somebody else (probably another process) changed the team under us
+		index.release_slot(team_id, player["best_position"])
+		index.refresh_team(team_id, storage().open_team(team_id))
 
-def create_team(summoner):
-	"""Creates a new team with the summoner as its leader"""
-	db = get_db()
-	cur = db.cursor()
+def check_summoner_searching(summoner):
+	"""Checks to see if the given summoner is currently searching for a team"""
+	# Any team they lead that's still open means they're still building one
+	return storage().leading_open_team(summoner.name)
 
-	# This will only create a player if they don't already exist
-	player = create_or_get_player(summoner)
+"""
+===============================
+Metrics
+===============================
+"""
 
-	insert_sql = '''INSERT INTO team (create_time) VALUES (?)'''
-	cur.execute(insert_sql, (epoch_time(),))
-	team_id = cur.lastrowid
+# Upper bounds of the latency histogram buckets, in milliseconds
+metric_buckets_ms = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+metric_help = {
+	"http_request_duration_ms": ("histogram", "Time spent serving each route"),
+	"riot_request_duration_ms": ("histogram", "Time spent waiting on each Riot endpoint, not counting rate limits"),
+	"riot_requests_total": ("counter", "Riot calls by endpoint and status"),
+	"sql_statement_duration_ms": ("histogram", "Time spent running SQL statements"),
+	"classification_duration_ms": ("histogram", "Time spent working out players' classifications"),
+	"riot_cache_lookups_total": ("counter", "Riot cache lookups by kind and how they were answered"),
+	"riot_cache_hit_ratio": ("gauge", "Share of Riot cache lookups answered without the API"),
+	"riot_rate_limit_waits_total": ("counter", "Riot calls that had to wait on each rate limit bucket"),
+	"riot_rate_limit_wait_ms_total": ("counter", "Time Riot calls spent waiting on each rate limit bucket"),
+	"riot_rate_limit_rejections_total": ("counter", "429s from Riot that each rate limit bucket let through"),
+	"riot_rate_limit_tokens": ("gauge", "Calls each rate limit bucket would let through right now"),
+	"riot_rate_limit_queued": ("gauge", "Riot calls waiting on each rate limit bucket"),
+}
+
+class Histogram(object):
+	__slots__ = ("counts", "total", "count")
+
+	def __init__(self):
+		super(Histogram, self).__init__()
+		self.counts = [0] * (len(metric_buckets_ms) + 1)
+		self.total = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(metric_buckets_ms, value)] += 1
+		self.total += value
+		self.count += 1
+
+class _Timer(object):
+	__slots__ = ("metrics", "name", "labels", "start")
+
+	def __init__(self, metrics, name, labels):
+		self.metrics = metrics
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.time()
+
+	def __exit__(self, *exc):
+		self.metrics.observe(self.name, self.labels, (time.time() - self.start) * 1000)
+
+class _NoTimer(object):
+	__slots__ = ()
+
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *exc):
+		pass
+
+_no_timer = _NoTimer()
+
+class Metrics(object):
+	"""
+	Counters and latency histograms for the hot paths, written out in the
+	Prometheus text format. Turned off, every call returns straight away
+	so the hooks can stay where they are. Labels are tuples of (name, value).
+	"""
+	def __init__(self, enabled=False):
+		super(Metrics, self).__init__()
+		self.enabled = enabled
+		self._lock = threading.Lock()
+		self._counters = Counter()
+		self._histograms = {}
+
+	def inc(self, name, labels=(), amount=1):
+		if self.enabled:
+			with self._lock:
+				self._counters[(name, labels)] += amount
+
+	def observe(self, name, labels, value):
+		if self.enabled:
+			with self._lock:
+				histogram = self._histograms.get((name, labels))
+				if histogram is None:
+					histogram = self._histograms[(name, labels)] = Histogram()
+				histogram.observe(value)
+
+	def timer(self, name, labels=()):
+		"""Times a with block into a histogram"""
+		return _Timer(self, name, labels) if self.enabled else _no_timer
+
+	def _labels(self, labels):
+		if not labels:
+			return ""
+		return "{" + ",".join('{0}="{1}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + "}"
+
+	def render(self, extra_counters=(), extra_gauges=()):
+		"""Writes everything out in the Prometheus text format"""
+		with self._lock:
+			counters = self._counters.items() + list(extra_counters)
+			histograms = [(key, list(h.counts), h.total, h.count) for key, h in self._histograms.iteritems()]
+
+		samples = {}
+		for (name, labels), value in sorted(counters):
+			samples.setdefault(name, []).append("{0}{1} {2}".format(name, self._labels(labels), value))
+		for (name, labels), value in sorted(extra_gauges):
+			samples.setdefault(name, []).append("{0}{1} {2}".format(name, self._labels(labels), value))
+		for (name, labels), counts, total, count in sorted(histograms):
+			lines = samples.setdefault(name, [])
+			cumulative = 0
+			for bound, bucket in zip(metric_buckets_ms + ("+Inf",), counts):
+				cumulative += bucket
+				lines.append("{0}_bucket{1} {2}".format(name, self._labels(labels + (("le", bound),)), cumulative))
+			lines.append("{0}_sum{1} {2}".format(name, self._labels(labels), total))
+			lines.append("{0}_count{1} {2}".format(name, self._labels(labels), count))
+
+		output = []
+		for name in sorted(samples):
+			kind, description = metric_help.get(name, ("untyped", name))
+			output.append("# HELP {0} {1}".format(name, description))
+			output.append("# TYPE {0} {1}".format(name, kind))
+			output.extend(samples[name])
+		return "\n".join(output) + "\n"
+
+metrics = Metrics(get_arg("metrics"))
+
+@app.before_request
+def start_request_timer():
+	if metrics.enabled:
+		g._request_start = time.time()
+
+@app.after_request
+def record_request_time(response):
+	start = getattr(g, "_request_start", None)
+	if start is not None:
+		# Label by the route rather than the URL so usernames don't each get their own series
+		route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+		metrics.observe("http_request_duration_ms", (("route", route), ("status", str(response.status_code))), (time.time() - start) * 1000)
+	return response
 
-	insert_sql = '''INSERT INTO players_teams (player_id, team_id, leader) VALUES (?, ?, 1)'''
-	cur.execute(insert_sql, (player, team_id))
+"""
+===============================
+Caching
+===============================
+"""
 
-	db.commit()
-	return team_id
+# Key prefix and TTL (in seconds, 0 is forever) for each kind of lookup.
+# Match details never change once a game is over so they can live forever,
+# match lists grow every game so they need to go stale quickly. local_ttl
+# caps how long the in-process copy lives. Summoners handed out of the local
+# cache pick up their matches as they're used, so they can't outlive those.
+cache_kinds = {
+	"summoner": {"prefix": "summ-", "ttl": 60 * 60, "negative_ttl": 5 * 60, "local_ttl": 10 * 60},
+	"summoner_id": {"prefix": "summid-", "ttl": 60 * 60, "negative_ttl": 5 * 60},
+	"matchlist": {"prefix": "matchlist-", "ttl": 10 * 60},
+	"match": {"prefix": "match-", "ttl": 0},
+	"mastery": {"prefix": "mastery-", "ttl": 60 * 60},
+	"champion": {"prefix": "champ-", "ttl": 0},
+	"classification": {"prefix": "class-", "ttl": 0},
+}
+
+# Stands in for "Riot told us this doesn't exist" so we can tell it apart from a miss
+_missing = "__riot-missing__"
+
+class LRUCache(object):
+	"""A bounded, thread-safe, in-process cache with per-entry expiry"""
+	def __init__(self, max_size):
+		super(LRUCache, self).__init__()
+		self.max_size = max_size
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry is None:
+				return None
+			expires, value = entry
+			if expires is not None and expires < time.time():
+				return None
+			self._entries[key] = entry
+			return value
+
+	def set(self, key, value, timeout=0):
+		expires = time.time() + timeout if timeout else None
+		with self._lock:
+			self._entries.pop(key, None)
+			self._entries[key] = (expires, value)
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+
+	def __len__(self):
+		return len(self._entries)
+
+class _Flight(object):
+	"""A load that's currently in progress that other threads can wait on"""
+	def __init__(self):
+		super(_Flight, self).__init__()
+		self.done = threading.Event()
+		self.value = None
+		self.error = None
+
+class LayeredCache(object):
+	"""
+	Read-through cache for Riot lookups. Checks the in-process LRU, then Redis
+	(if we have it), and only then loads from the API. Concurrent misses for
+	the same key wait on a single load instead of stampeding the API.
+	"""
+	def __init__(self, local, remote=None):
+		super(LayeredCache, self).__init__()
+		self.local = local
+		self.remote = remote
+		self._flights = {}
+		self._lock = threading.Lock()
+		self._counters = Counter()
+
+	def _key(self, kind, key):
+		return cache_kinds[kind]["prefix"] + str(key)
+
+	def count(self, kind, counter, amount=1):
+		with self._lock:
+			self._counters[(kind, counter)] += amount
+
+	def _unwrap(self, value):
+		return None if value == _missing else value
+
+	def _local_timeout(self, kind, timeout):
+		cap = cache_kinds[kind].get("local_ttl")
+		if cap is None:
+			return timeout
+		return min(timeout, cap) if timeout else cap
+
+	def _lookup(self, kind, full_key):
+		value = self.local.get(full_key)
+		if value is not None:
+			self.count(kind, "local_hits")
+			return value
+
+		if self.remote is not None:
+			try:
+				value = self.remote.get(full_key)
+			except Exception:
+				# Most likely pickled by an older version whose classes can't
+				# load it any more (werkzeug only catches PickleError). It'll
+				# never expire on its own so get rid of it and load it again.
+				self.count(kind, "remote_errors")
+				self._forget(full_key)
+				value = None
+			if value is not None:
+				self.count(kind, "remote_hits")
+				self.local.set(full_key, value, self._local_timeout(kind, cache_kinds[kind]["ttl"]))
+				return value
 
-def join_team(player_id, player_req_id, team_id):
-	"""Sets up a player to join a team"""
-	db = get_db()
-	cur = db.cursor()
+		return None
 
-	insert_sql = '''INSERT INTO players_teams (player_id, team_id) VALUES (?, ?)'''
-	cur.execute(insert_sql, (player_id, team_id))
-	team_id = cur.lastrowid
+	def _forget(self, full_key):
+		try:
+			self.remote.delete(full_key)
+		except Exception:
+			pass
 
-	update_sql = '''UPDATE player_req SET finish_time = ? WHERE id = ?'''
-	cur.execute(update_sql, (epoch_time(), player_req_id))
+	def get(self, kind, key):
+		"""Gets a cached value without loading it"""
+		return self._unwrap(self._lookup(kind, self._key(kind, key)))
+
+	def get_many(self, kind, keys):
+		"""Gets whichever keys are cached, as a dict. Keys remembered as missing come back as None."""
+		found = {}
+		for key in keys:
+			value = self._lookup(kind, self._key(kind, key))
+			if value is not None:
+				found[key] = self._unwrap(value)
+		return found
+
+	def set(self, kind, key, value):
+		"""Stores a value in every layer. A value of None is remembered as missing if the kind allows it."""
+		options = cache_kinds[kind]
+		timeout = options["ttl"]
+		if value is None:
+			if "negative_ttl" not in options:
+				return
+			value = _missing
+			timeout = options["negative_ttl"]
+
+		full_key = self._key(kind, key)
+		self.local.set(full_key, value, self._local_timeout(kind, timeout))
+		if self.remote is not None:
+			self.remote.set(full_key, value, timeout=timeout)
+
+	def get_or_load(self, kind, key, loader):
+		"""Gets a value from the cache, calling loader to fill it in on a miss"""
+		full_key = self._key(kind, key)
+		value = self._lookup(kind, full_key)
+		if value is not None:
+			return self._unwrap(value)
+
+		with self._lock:
+			flight = self._flights.get(full_key)
+			leader = flight is None
+			if leader:
+				flight = self._flights[full_key] = _Flight()
+
+		if not leader:
+			self.count(kind, "coalesced")
+			flight.done.wait()
+			if flight.error is not None:
+				raise flight.error
+			return flight.value
+
+		self.count(kind, "misses")
+		try:
+			flight.value = loader()
+			self.set(kind, key, flight.value)
+			return flight.value
+		except Exception as e:
+			flight.error = e
+			raise
+		finally:
+			with self._lock:
+				del self._flights[full_key]
+			flight.done.set()
+
+	def stats(self):
+		with self._lock:
+			stats = dict((kind, {"local_hits": 0, "remote_hits": 0, "misses": 0, "coalesced": 0, "remote_errors": 0}) for kind in cache_kinds)
+			for (kind, counter), count in self._counters.iteritems():
+				stats[kind][counter] = count
+		for kind_stats in stats.values():
+			lookups = kind_stats["local_hits"] + kind_stats["remote_hits"] + kind_stats["misses"]
+			kind_stats["hit_ratio"] = float(lookups - kind_stats["misses"]) / lookups if lookups else 0.0
+		stats["local_size"] = len(self.local)
+		return stats
+
+def store_summoner(summoner, measure=False):
+	"""
+	Writes a summoner back to the cache if we worked anything out about them
+	during this request. The local cache gets the same compact state Redis
+	does, not the summoner with their matches and masteries hanging off it.
+	With measure (or metrics turned on) returns how many bytes that state
+	pickles to, otherwise 0.
+	"""
+	if summoner is None or not summoner._dirty:
+		return 0
+
+	summoner._dirty = False
+	state = summoner.__getstate__()
+	compact = Summoner.__new__(Summoner)
+	compact.__setstate__(state)
+	riot_cache.set("summoner", normalize_name(summoner.name), compact)
+	riot_cache.count("summoner", "writes")
+
+	if not (measure or metrics.enabled):
+		return 0
+	# Pickled the way werkzeug's RedisCache does it, less its one byte marker
+	size = len(pickle.dumps(compact))
+	riot_cache.count("summoner", "bytes_written", size)
+	return size
+
+riot_cache = LayeredCache(LRUCache(get_arg("local_cache_size", default=10000)), remote=cache)
 
-	query_sql = '''SELECT count(*) FROM players_teams WHERE team_id = ?'''
-	count = query_db(query_sql, [team_id], one=True)
-	print team_id
-	print count
-	if count >= 5:
-		update_sql = '''UPDATE team SET finish_time = ? WHERE id = ?'''
-		cur.execute(update_sql, (epoch_time(), team_id))
+"""
+===============================
+Champion Index
+===============================
+"""
 
-	db.commit()
-	return team_id
+champions_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "champions.json")
+
+# The compiled version of champions_file, see compile_champions.py
+champions_artifact = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "champions.bin")
+
+# Bump this whenever the artifact's layout or champion_fields change
+champions_artifact_version = 1
+
+# The only parts of the static data we ever look at
+champion_fields = ("id", "key", "name", "title", "tags", "info")
+
+# What gets decoded out of the static champion data, see select_json
+champion_data_shape = {"version": True, "data": {"*": frozenset(champion_fields)}}
+
+def slim_champion(json_obj):
+	"""Strips a champion's static data down to the fields we actually use"""
+	return dict((field, json_obj[field]) for field in champion_fields if field in json_obj)
+
+class ChampionIndex(object):
+	"""
+	Read-only lookup of every champion by id, key and name. Built once per
+	process, before forking where possible, so workers share it.
+	"""
+	def __init__(self, champions):
+		super(ChampionIndex, self).__init__()
+		self._by_id = {}
+		self._by_key = {}
+		self._by_name = {}
+		for champion in champions:
+			self._by_id[champion.c_id] = champion
+			self._by_key[champion.key.lower()] = champion
+			self._by_name[normalize_name(champion.name)] = champion
+		self._all = tuple(sorted(self._by_id.values(), key=lambda c: c.name))
+
+	def get(self, champion_id):
+		return self._by_id.get(int(champion_id))
+
+	def by_key(self, key):
+		return self._by_key.get(key.lower())
+
+	def by_name(self, name):
+		return self._by_name.get(normalize_name(name))
+
+	def all(self):
+		return self._all
+
+	def __len__(self):
+		return len(self._by_id)
+
+	@classmethod
+	def from_json(cls, champs_data):
+		return cls(Champion(slim_champion(c)) for c in champs_data)
+
+	@classmethod
+	def from_file(cls, path=champions_file):
+		with open(path) as f:
+			return cls.from_json(select_json(f.read(), champion_data_shape)["data"].values())
+
+	@classmethod
+	def from_artifact(cls, path=champions_artifact):
+		with open(path, "rb") as f:
+			artifact = pickle.load(f)
+		if artifact.get("version") != champions_artifact_version:
+			raise ValueError("Champion artifact is version {0}, expected {1}".format(artifact.get("version"), champions_artifact_version))
+		return cls.from_json(artifact["champions"])
+
+	@classmethod
+	def from_api(cls):
+		champs_data_url = full_url(static_base_url, champ_all(), query_params={"champData": "info,tags"})
+		return cls.from_json(response_json(get_request(champs_data_url), champion_data_shape)["data"].values())
+
+_champion_index = None
+_champion_index_lock = threading.Lock()
+
+def compile_champions(source=champions_file, target=champions_artifact):
+	"""
+	Compiles the static champion data down to just the fields we use so it
+	can be loaded without parsing the whole file. Returns the artifact size.
+	"""
+	with open(source) as f:
+		data = select_json(f.read(), champion_data_shape)
+
+	artifact = {
+		"version": champions_artifact_version,
+		"data_version": data["version"],
+		"champions": [slim_champion(c) for c in data["data"].values()]
+	}
+	with open(target, "wb") as f:
+		pickle.dump(artifact, f, pickle.HIGHEST_PROTOCOL)
+	return os.path.getsize(target)
+
+def _artifact_is_fresh():
+	return os.path.exists(champions_artifact) and os.path.getmtime(champions_artifact) >= os.path.getmtime(champions_file)
+
+def champion_index():
+	"""Gets the champion index, building it the first time it's needed"""
+	global _champion_index
+	if _champion_index is None:
+		with _champion_index_lock:
+			if _champion_index is None:
+				if not get_arg("cache"):
+					_champion_index = ChampionIndex.from_api()
+				elif _artifact_is_fresh():
+					try:
+						_champion_index = ChampionIndex.from_artifact(champions_artifact)
+					except Exception as e:
+						# Usually an artifact from before champions_artifact_version was bumped
+						print("Couldn't load {0} ({1}), using {2} instead. Run compile_champions.py to rebuild it.".format(champions_artifact, e, champions_file))
+						_champion_index = ChampionIndex.from_file(champions_file)
+				else:
+					_champion_index = ChampionIndex.from_file(champions_file)
+	return _champion_index
+
+def preload_champion_index():
+	"""
+	Loads the compiled artifact into the index before any workers are forked
+	so they all share the one copy. Leaves the index to be built the usual
+	way if the artifact can't be loaded.
+	"""
+	global _champion_index
+	try:
+		_champion_index = ChampionIndex.from_artifact(champions_artifact)
+	except Exception as e:
+		print("Couldn't preload {0} ({1}). Run compile_champions.py to rebuild it.".format(champions_artifact, e))
 
-def check_summoner_searching(summoner):
-	"""Checks to see if the given summoner is currently searching for a team"""
-	db = get_db()
-	cur = db.cursor()
+"""
+===============================
+Concurrent Fetching
+===============================
+"""
 
-	player = check_for_player(summoner)
+_fetch_pool = None
+_fetch_pool_lock = threading.Lock()
+
+def fetch_pool():
+	"""Gets the shared pool used to fan out Riot API requests"""
+	global _fetch_pool
+	if _fetch_pool is None:
+		with _fetch_pool_lock:
+			if _fetch_pool is None:
+				_fetch_pool = ThreadPool(max(1, get_arg("workers", default=8)))
+	return _fetch_pool
+
+def fan_out(func, items):
+	"""Runs func over items on the fetch pool and returns the results in order"""
+	items = list(items)
+	if len(items) <= 1:
+		return map(func, items)
+	return fetch_pool().map(func, items)
+
+def prefetch_matches(summoner, limit=None, data=True, champions=True):
+	"""
+	Resolves the lazy match data and champions for a summoner's matches
+	in parallel so the properties don't block one request at a time.
+	"""
+	matches = summoner.matches
+	if limit is not None:
+		matches = matches[:limit]
+
+	def resolve(match):
+		if data:
+			match.match_data
+		if champions:
+			match.match_champion
+		return match
+
+	return fan_out(resolve, matches)
 
-	if not player:
-		return False
-	else:
-		teams = query_db('''SELECT team_id FROM players_teams WHERE player_id = ? AND leader = 1''', [player])
+"""
+===============================
+Player Classification
+===============================
+"""
+
+# Bump this whenever ClassificationState changes shape
+classification_state_version = 2
+
+class ClassificationState(object):
+	"""
+	Running totals of how a player plays, kept so a returning player's
+	classifications can be updated from just their new matches and
+	whichever masteries changed rather than rebuilt from scratch.
+	"""
+	def __init__(self):
+		super(ClassificationState, self).__init__()
+		self.version = classification_state_version
+		# champion name -> lane -> games played there, with the lanes in the
+		# order they first show up going from the newest match back
+		self.champion_lanes = {}
+		# champion id -> (name, tags, points, level), in the order the API gave them to us
+		self.masteries = OrderedDict()
+		# tag -> total points/levels across the champions with that tag
+		self.tag_scores = {}
+		self.tag_levels = {}
+		self.last_match_timestamp = 0
+
+	def copy(self):
+		state = ClassificationState()
+		state.champion_lanes = dict((name, OrderedDict(lanes)) for name, lanes in self.champion_lanes.iteritems())
+		state.masteries = OrderedDict(self.masteries)
+		state.tag_scores = dict(self.tag_scores)
+		state.tag_levels = dict(self.tag_levels)
+		state.last_match_timestamp = self.last_match_timestamp
+		return state
+
+	def update(self, matches, masteries):
+		self.update_matches(matches)
+		self.update_masteries(masteries)
+
+	def update_matches(self, matches):
+		"""Counts up the lanes for any matches newer than the last one we saw"""
+		new_matches = [m for m in matches if m.timestamp > self.last_match_timestamp]
+		fan_out(lambda m: m.match_champion, new_matches)
+
+		# Match lists come back newest first, count them in the same order
+		counted = {}
+		for match in new_matches:
+			lanes = counted.setdefault(match.match_champion.name, OrderedDict())
+			lanes[match.lane] = lanes.get(match.lane, 0) + 1
+			self.last_match_timestamp = max(self.last_match_timestamp, match.timestamp)
+
+		# The new matches are newer than anything already counted, so their
+		# lanes go in front of the ones we had
+		for name, lanes in counted.iteritems():
+			for lane, count in self.champion_lanes.get(name, {}).iteritems():
+				lanes[lane] = lanes.get(lane, 0) + count
+			self.champion_lanes[name] = lanes
+
+	def lanes(self, name):
+		"""
+		The lanes a champion has been played in, most games first. Ties come
+		out the way they did when every match was counted on each request.
+		"""
+		# A dict filled in newest first is laid out the same as the one the
+		# full count built, whatever order the updates came in
+		played = dict(self.champion_lanes.get(name, {}).items())
+		lanes = [{"lane": lane, "count": count} for lane, count in played.iteritems()]
+		lanes.sort(key=lambda l: l["count"], reverse=True)
+		return lanes
+
+	def _adjust_tags(self, tags, points, level):
+		for tag in tags:
+			self.tag_scores[tag] = self.tag_scores.get(tag, 0) + points
+			self.tag_levels[tag] = self.tag_levels.get(tag, 0) + level
+
+	def update_masteries(self, masteries):
+		"""Applies whatever changed between the masteries we had and these ones"""
+		current = OrderedDict()
+		changed = []
+		for mastery in masteries:
+			previous = self.masteries.get(mastery.champion_id)
+			if previous is not None and previous[2:] == (mastery.champion_points, mastery.champion_level):
+				current[mastery.champion_id] = previous
+			else:
+				current[mastery.champion_id] = None
+				changed.append(mastery)
+
+		fan_out(lambda m: m.champion, changed)
+		for mastery in changed:
+			previous = self.masteries.get(mastery.champion_id)
+			if previous is not None:
+				self._adjust_tags(previous[1], -previous[2], -previous[3])
+
+			champion = mastery.champion
+			tags = tuple(champion.tags)
+			self._adjust_tags(tags, mastery.champion_points, mastery.champion_level)
+			current[mastery.champion_id] = (champion.name, tags, mastery.champion_points, mastery.champion_level)
+
+		# Masteries don't usually go away, but if they do so do their points
+		for champion_id, previous in self.masteries.iteritems():
+			if champion_id not in current:
+				self._adjust_tags(previous[1], -previous[2], -previous[3])
+
+		self.masteries = current
+
+	def classifications(self):
+		"""Lays the totals out the way the frontend expects them"""
+		bins = {}
+		for name, tags, points, level in self.masteries.itervalues():
+			for bin_type in tags:
+				if bin_type not in bins:
+					bins[bin_type] = {"classification": bin_type, "champions": [], "score": self.tag_scores[bin_type], "overall_level": self.tag_levels[bin_type]}
+
+				bins[bin_type]["champions"].append({"name": name, "score": points, "lanes": self.lanes(name)})
+
+		classifications = []
+		for b_type, data in bins.iteritems():
+			# Maintain order on each champion
+			data["champions"].sort(key=lambda c: c["score"], reverse=True)
+			classifications.append(data)
+
+		# We also want to maintain order on each type
+		classifications.sort(key=lambda c: c["score"], reverse=True)
+		return classifications
+
+"""
+===============================
+Matchmaking
+===============================
+"""
+
+team_size = 5
+
+def position_key(best_position):
+	"""
+	Gets the part of a player's best position that can't be shared on a team,
+	or None if anyone can share it. Bottom lane has room for two.
+	"""
+	lane = best_position.split()[0]
+	if lane == "BOTTOM":
+		return None
+	return best_position
+
+class MatchmakingIndex(object):
+	"""
+	Keeps every open team in memory, grouped by the leader's tier and how
+	full the team is, along with which positions each team already has.
+	Finding a compatible team is then a handful of set lookups instead of
+	a query per open team.
+	"""
+	def __init__(self):
+		super(MatchmakingIndex, self).__init__()
+		self._lock = threading.Lock()
+		# team id -> (tier, size, [position keys])
+		self._teams = {}
+		# tier -> size -> team ids, oldest first
+		self._by_size = {}
+		# tier -> position key -> team ids that already have it
+		self._taken = {}
+		# team id -> claims on it that haven't been settled or released yet
+		self._claiming = Counter()
+
+	def _bucket(self, tier, size):
+		return self._by_size.setdefault(tier, {}).setdefault(size, OrderedDict())
+
+	def _add(self, team_id, tier, positions):
+		size = len(positions)
+		self._teams[team_id] = (tier, size, positions)
+		self._bucket(tier, size)[team_id] = True
+		for position in positions:
+			if position is not None:
+				self._taken.setdefault(tier, {}).setdefault(position, set()).add(team_id)
+
+	def _remove(self, team_id):
+		tier, size, positions = self._teams.pop(team_id)
+		del self._by_size[tier][size][team_id]
+		for position in positions:
+			if position is not None:
+				self._taken[tier][position].discard(team_id)
+		return tier, positions
+
+	def add_team(self, team_id, tier, leader_position):
+		"""Puts a freshly created team into the index"""
+		with self._lock:
+			self._add(team_id, tier, [position_key(leader_position)])
+
+	def _claim_done(self, team_id):
+		self._claiming[team_id] -= 1
+		if self._claiming[team_id] <= 0:
+			del self._claiming[team_id]
+
+	def claim_slot(self, tier, best_position):
+		"""
+		Finds the fullest compatible open team for a player and takes a spot
+		on it for them. Returns the team id or None if nothing fits. Once the
+		join is saved call settle_slot, or release_slot if it couldn't be.
+		"""
+		position = position_key(best_position)
+		with self._lock:
+			taken = self._taken.get(tier, {}).get(position, ())
+			sizes = self._by_size.get(tier, {})
+			for size in range(team_size - 1, 0, -1):
+				for team_id in sizes.get(size, ()):
+					if team_id not in taken:
+						# Full teams stay in the index until the join is
+						# settled, but nothing looks in their size bucket
+						_, positions = self._remove(team_id)
+						self._add(team_id, tier, positions + [position])
+						self._claiming[team_id] += 1
+						return team_id
+		return None
+
+	def settle_slot(self, team_id):
+		"""Marks a claimed slot as saved, dropping the team from the index if that filled it up"""
+		with self._lock:
+			self._claim_done(team_id)
+			if team_id in self._teams and self._teams[team_id][1] >= team_size:
+				self._remove(team_id)
+
+	def release_slot(self, team_id, best_position):
+		"""Gives back a slot we claimed but couldn't save"""
+		position = position_key(best_position)
+		with self._lock:
+			self._claim_done(team_id)
+			if team_id in self._teams:
+				tier, positions = self._remove(team_id)
+				positions = list(positions)
+				# It might have been refreshed from storage since
+				if position in positions:
+					positions.remove(position)
+				self._add(team_id, tier, positions)
+
+	def refresh_team(self, team_id, team):
+		"""Replaces what we know about a team with what storage says, (tier, positions) or None if it's closed"""
+		with self._lock:
+			if team_id in self._teams:
+				self._remove(team_id)
+			if team is not None:
+				tier, positions = team
+				if len(positions) < team_size:
+					self._add(team_id, tier, [position_key(p) for p in positions])
+
+	def sync(self, open_teams):
+		"""
+		Brings the index in line with the (team_id, tier, positions) open
+		teams in storage, so teams other processes created or changed get
+		matched here too. Teams with a claim still being saved are left to
+		that claim to sort out.
+		"""
+		with self._lock:
+			current = OrderedDict((team_id, (tier, [position_key(p) for p in positions])) for team_id, tier, positions in open_teams)
+			for team_id in self._teams.keys():
+				if team_id not in current and team_id not in self._claiming:
+					self._remove(team_id)
+
+			for team_id, (tier, positions) in current.iteritems():
+				known = self._teams.get(team_id)
+				if team_id in self._claiming or (known is not None and known[0] == tier and sorted(known[2]) == sorted(positions)):
+					continue
+				if known is not None:
+					self._remove(team_id)
+				if len(positions) < team_size:
+					self._add(team_id, tier, positions)
+
+	def size(self, team_id):
+		"""How many players the index thinks are on a team"""
+		with self._lock:
+			team = self._teams.get(team_id)
+			return team[1] if team is not None else 0
+
+	def __len__(self):
+		return len(self._teams)
+
+	@classmethod
+	def from_storage(cls, store):
+		"""Builds the index from the open teams in storage"""
+		index = cls()
+		for team_id, tier, positions in store.open_teams():
+			index._add(team_id, tier, [position_key(p) for p in positions])
+		return index
+
+_matchmaking_index = None
+_matchmaking_index_lock = threading.Lock()
+
+def matchmaking_index():
+	"""Gets the matchmaking index, building it from storage the first time it's needed"""
+	global _matchmaking_index
+	if _matchmaking_index is None:
+		with _matchmaking_index_lock:
+			if _matchmaking_index is None:
+				_matchmaking_index = MatchmakingIndex.from_storage(storage())
+	return _matchmaking_index
+
+def matchmaking_tick():
+	"""
+	Tries to place every pending player request on an open team in one go
+	and saves all the joins in a single transaction. Oldest requests go
+	first and each one takes the fullest team it fits on, so we close out
+	as many teams as we can. Returns stats about the run.
+	"""
+	start = time.time()
+	index = matchmaking_index()
+
+	store = storage()
+	# Other processes make and join teams too, so start from what storage has
+	index.sync(store.open_teams())
+	pending = store.pending_requests()
+
+	claims = []
+	for row in pending:
+		team_id = index.claim_slot(row["highest_rank"], row["best_position"])
+		if team_id is not None:
+			claims.append((row, team_id))
+
+	try:
+		joined = store.claim_slots([(row["player_id"], row["req_id"], team_id, row["best_position"]) for row, team_id in claims])
+		store.commit()
+	except Exception:
+		store.rollback()
+		for row, team_id in claims:
+			index.release_slot(team_id, row["best_position"])
+		raise
+
+	matched = joined.count(True)
+	# Claims that didn't go through give their slot back, including requests someone else already placed
+	for (row, team_id), ok in zip(claims, joined):
+		if not ok:
+			index.release_slot(team_id, row["best_position"])
+
+	# Teams where a claim didn't go through get reloaded from storage, the rest just settle
+	stale = set(team_id for (row, team_id), ok in zip(claims, joined) if ok is False)
+	filled = set(team_id for (row, team_id), ok in zip(claims, joined) if ok and team_id not in stale and index.size(team_id) >= team_size)
+	for (row, team_id), ok in zip(claims, joined):
+		if ok:
+			index.settle_slot(team_id)
+	for team_id in stale:
+		index.refresh_team(team_id, store.open_team(team_id))
+
+	return {
+		"duration_ms": (time.time() - start) * 1000,
+		"pending": len(pending),
+		"matched": matched,
+		"match_rate": float(matched) / len(pending) if pending else 0.0,
+		"teams_filled": len(filled),
+		"time": epoch_time()
+	}
+
+class MatchmakingScheduler(threading.Thread):
+	"""Runs matchmaking_tick every so often, or sooner when something changes"""
+	def __init__(self, interval):
+		super(MatchmakingScheduler, self).__init__(name="matchmaking")
+		self.daemon = True
+		self.interval = interval
+		self.last_tick = None
+		self.ticks = 0
+		self._wake = threading.Event()
+
+	def poke(self):
+		"""Lets the scheduler know there's a new team or request worth looking at"""
+		self._wake.set()
+
+	def run(self):
+		while True:
+			self._wake.wait(self.interval)
+			self._wake.clear()
+			try:
+				with app.app_context():
+					self.last_tick = matchmaking_tick()
+				self.ticks += 1
+			except Exception as e:
+				print("Matchmaking tick failed: {0}".format(e))
+
+	def stats(self):
+		return {"interval": self.interval, "ticks": self.ticks, "last_tick": self.last_tick}
+
+matchmaking_scheduler = None
+
+def poke_matchmaking():
+	if matchmaking_scheduler is not None:
+		matchmaking_scheduler.poke()
+
+"""
+===============================
+Profile Jobs
+===============================
+"""
+
+def join_summoner(summoner):
+	"""Opens a request for the summoner and tries to put them on a team straight away. Returns (response, error)."""
+	player_request = create_player_request(summoner)
+	store_summoner(summoner)
+	player = storage().find_player(summoner.name)
+
+	# Then we're gonna see if we can close this req as fast as possible
+	team_id = join_team(player, player_request)
+	storage().commit()
+
+	if team_id is None:
+		poke_matchmaking()
+		return {"message": "No teams just yet, but you're on the list!"}, None
+
+	return "WE FOUND YOU A TEAM!", None
+
+def make_summoner_team(summoner):
+	"""Creates a team with the summoner as its leader. Returns (response, error)."""
+	if check_summoner_searching(summoner):
+		# If the current summoner is building a team, that's an error
+		return None, {"message": "You're already building a team!"}
+
+	# If they're not actively leading a team, create a new one and insert them as the leader
+	create_team(summoner)
+	store_summoner(summoner)
+	poke_matchmaking()
+	return {"leader": summoner.name}, None
+
+profile_actions = {
+	"join": join_summoner,
+	"make": make_summoner_team
+}
+
+class JobBroker(object):
+	"""
+	Where profile jobs wait for a worker. There's only ever one live job
+	per summoner; asking again while it's waiting or running just adds the
+	action to it. LocalBroker keeps everything in this process, a shared
+	broker would let several API processes split the work.
+	"""
+	def submit(self, summoner_name, action):
+		"""Queues an action for a summoner and returns the id of the job it'll run in"""
+		raise NotImplementedError()
+
+	def take(self, timeout=None):
+		"""Waits for the next job and marks it as running. Returns the job or None."""
+		raise NotImplementedError()
+
+	def next_action(self, job_id):
+		"""Gets the job's next action to run, or marks it done and returns None if there's nothing left"""
+		raise NotImplementedError()
+
+	def record(self, job_id, action, response, error=None):
+		raise NotImplementedError()
+
+	def fail(self, job_id, error):
+		raise NotImplementedError()
+
+	def status(self, job_id):
+		"""Gets a job, or None if we've never heard of it (or forgotten it)"""
+		raise NotImplementedError()
+
+	def stats(self):
+		return {}
+
+class LocalBroker(JobBroker):
+	"""Keeps jobs in memory. Finished jobs hang around until there are more than keep of them."""
+	def __init__(self, keep=10000):
+		super(LocalBroker, self).__init__()
+		self.keep = keep
+		self._lock = threading.Lock()
+		self._queue = Queue.Queue()
+		self._ids = itertools.count(1)
+		self._jobs = {}
+		# summoner name -> id of their waiting or running job
+		self._active = {}
+		self._finished = deque()
+		self._counts = Counter()
+
+	def submit(self, summoner_name, action):
+		with self._lock:
+			job_id = self._active.get(summoner_name)
+			if job_id is not None:
+				job = self._jobs[job_id]
+				if action not in job["actions"] and action not in job["results"]:
+					job["actions"].append(action)
+				self._counts["deduped"] += 1
+				return job_id
+
+			job_id = str(next(self._ids))
+			self._jobs[job_id] = {
+				"id": job_id,
+				"summoner": summoner_name,
+				"status": "queued",
+				"actions": [action],
+				"results": {},
+				"error": None,
+				"create_time": epoch_time(),
+				"finish_time": None
+			}
+			self._active[summoner_name] = job_id
+			self._counts["submitted"] += 1
+		self._queue.put(job_id)
+		return job_id
+
+	def take(self, timeout=None):
+		try:
+			job_id = self._queue.get(timeout=timeout)
+		except Queue.Empty:
+			return None
+
+		with self._lock:
+			job = self._jobs[job_id]
+			job["status"] = "running"
+			return dict(job)
+
+	def _finish(self, job, status):
+		job["status"] = status
+		job["finish_time"] = epoch_time()
+		del self._active[job["summoner"]]
+		self._counts[status] += 1
+
+		self._finished.append(job["id"])
+		while len(self._finished) > self.keep:
+			del self._jobs[self._finished.popleft()]
+
+	def next_action(self, job_id):
+		with self._lock:
+			job = self._jobs[job_id]
+			if job["actions"]:
+				return job["actions"].pop(0)
+			# Done under the lock so a submit can't add an action nobody will run
+			self._finish(job, "done")
+			return None
+
+	def record(self, job_id, action, response, error=None):
+		with self._lock:
+			self._jobs[job_id]["results"][action] = {"response": response, "error": error}
+
+	def fail(self, job_id, error):
+		with self._lock:
+			job = self._jobs[job_id]
+			job["error"] = error
+			self._finish(job, "failed")
+
+	def status(self, job_id):
+		with self._lock:
+			job = self._jobs.get(job_id)
+			return dict(job, actions=list(job["actions"]), results=dict(job["results"])) if job is not None else None
+
+	def stats(self):
+		with self._lock:
+			return dict(self._counts, queued=self._queue.qsize(), active=len(self._active))
+
+class ProfileWorker(threading.Thread):
+	"""
+	Works out profiles for new players (rank and best position, which can
+	take a lot of Riot calls) and then runs whatever they asked for. The
+	profile ends up in storage, so the player's later requests are instant.
+	"""
+	def __init__(self, broker, number):
+		super(ProfileWorker, self).__init__(name="profiles-{0}".format(number))
+		self.daemon = True
+		self.broker = broker
+
+	def run(self):
+		while True:
+			job = self.broker.take()
+			if job is not None:
+				self.work(job)
+
+	def work(self, job):
+		with app.app_context():
+			try:
+				summoner = name_to_summoner(job["summoner"])
+				if summoner is None:
+					self.broker.fail(job["id"], {"message": "Could not find summoner."})
+					return
+
+				create_or_get_player(summoner)
+				store_summoner(summoner)
+				storage().commit()
+
+				action = self.broker.next_action(job["id"])
+				while action is not None:
+					response, error = profile_actions[action](summoner)
+					self.broker.record(job["id"], action, response, error)
+					action = self.broker.next_action(job["id"])
+			except Exception as e:
+				storage().rollback()
+				self.broker.fail(job["id"], {"message": str(e)})
+
+profile_broker = None
+
+def start_profile_workers(broker, count):
+	"""Hands new players' profiles off to count background workers"""
+	global profile_broker
+	profile_broker = broker
+	for number in range(count):
+		ProfileWorker(broker, number).start()
+
+def run_for_summoner(summoner, action):
+	"""
+	Runs a team action for a summoner. Known players go straight through.
+	New players get queued for a worker while we still have background
+	workers, and the response points at the job.
+	"""
+	if profile_broker is None or check_for_player(summoner):
+		response, error = profile_actions[action](summoner)
+		if error is not None:
+			return make_error(error=error, response_code=200)
+		return make_success(response=response)
+
+	job_id = profile_broker.submit(summoner.name, action)
+	return make_success(response={
+		"message": "Working out your profile, check back in a moment.",
+		"job": job_id,
+		"status_url": url_for("job_status", job_id=job_id)
+	}, response_code=202)
 
-		# Scan through all the teams they've ever lead and see if any are still active
-		for team in teams:
-			team_active = query_db('''SELECT id FROM team WHERE id = ? AND finish_time IS NULL''', [team["team_id"]], one=True)
-			if team_active is not None:
-				return True
+"""
+===============================
+Crawling
+===============================
+"""
 
-	return False
+def rate_limit_waits():
+	"""How many times anything has had to wait on a rate limit bucket"""
+	return sum(bucket["waits"] for buckets in rate_limiter.stats().values() for bucket in buckets)
+
+def crawl(seeds, max_depth=2, max_players=500, matches_per_summoner=3, batch_size=50):
+	"""
+	Walks out from the seed summoner names through the people they've
+	played with, breadth first, adding everyone as a player. Stops after
+	max_depth hops or max_players summoners. Players go in batch_size at
+	a time. Yields progress after each batch and once more at the end.
+	"""
+	start = time.time()
+	waits = rate_limit_waits()
+	progress = Counter()
+	seen = set()
+	queue = deque()
+	batch = []
+
+	def report(done=False):
+		return dict(progress, queued=len(queue), seen=len(seen), rate_limit_waits=rate_limit_waits() - waits,
+			elapsed=time.time() - start, done=done)
+
+	def flush():
+		progress["inserted"] += storage().add_players(batch)
+		storage().commit()
+		del batch[:]
+
+	for summoner in names_to_summoners(seeds):
+		if summoner is None:
+			progress["not_found"] += 1
+		elif summoner.s_id not in seen:
+			seen.add(summoner.s_id)
+			queue.append((summoner, 0))
+
+	while queue and progress["processed"] < max_players:
+		summoner, depth = queue.popleft()
+		progress["processed"] += 1
+
+		if depth < max_depth and len(seen) < max_players:
+			try:
+				matches = prefetch_matches(summoner, limit=matches_per_summoner, champions=False)
+				found = set(itertools.chain.from_iterable(match.match_data.summoner_ids for match in matches)) - seen
+				for other in ids_to_summoners(sorted(found)[:max_players - len(seen)]):
+					seen.add(other.s_id)
+					queue.append((other, depth + 1))
+			except Exception:
+				# One summoner's matches going wrong shouldn't end the whole crawl,
+				# and they'd only fail again being classified
+				progress["failed"] += 1
+				continue
+
+		if check_for_player(summoner):
+			progress["existing"] += 1
+		else:
+			try:
+				batch.append(player_profile(summoner))
+				store_summoner(summoner)
+			except Exception:
+				# Usually someone without any ranked games to go on
+				progress["failed"] += 1
+
+		if len(batch) >= batch_size:
+			flush()
+			yield report()
+
+	flush()
+	yield report(done=True)
 
 """
 ===============================
@@ -372,13 +2498,50 @@ Quick Data Models
 ===============================
 """
 
+# Bump this whenever the derived summoner state changes shape
+summoner_state_version = 1
+
+# Bump this whenever the slots of the other models change
+model_state_version = 1
+
 class JSONObject(object):
+	# Everything below uses slots so we don't pay for a __dict__ per object. The
+	# raw JSON is dropped once we've pulled out what we need unless keep_json is set.
+	__slots__ = ("json",)
+
 	def __init__(self, json):
 		super(JSONObject, self).__init__()
-		self.json = json
+		self.json = json if keep_json else None
+
+	def __getstate__(self):
+		"""
+		Slotted objects can't be pickled at the protocol werkzeug's RedisCache
+		uses without this. The raw JSON and anything looked up lazily (the _
+		slots) are left out, they're cached on their own.
+		"""
+		state = {"version": model_state_version}
+		for cls in type(self).__mro__:
+			for slot in getattr(cls, "__slots__", ()):
+				if slot != "json" and not slot.startswith("_") and hasattr(self, slot):
+					state[slot] = getattr(self, slot)
+		return state
+
+	def __setstate__(self, state):
+		if state.pop("version", None) != model_state_version:
+			# Pickled before the models had slots, the cache treats this as a miss
+			raise ValueError("{0} was cached in an older layout".format(type(self).__name__))
+		self.json = None
+		for cls in type(self).__mro__:
+			for slot in getattr(cls, "__slots__", ()):
+				if slot.startswith("_"):
+					setattr(self, slot, None)
+		for slot, value in state.iteritems():
+			setattr(self, slot, value)
 
 class Match(JSONObject):
 	"""Match model object for working with data from the API. Treat this as readonly."""
+	__slots__ = ("timestamp", "champion", "region", "queue", "season", "match_id", "role", "platform_id", "lane", "_match", "_champion")
+
 	def __init__(self, json_obj):
 		super(Match, self).__init__(json_obj)
 		self.timestamp = json_obj["timestamp"]
@@ -409,26 +2572,119 @@ class Match(JSONObject):
 			self._champion = specific_champion(self.champion)
 		return self._champion
 
+# Bump this whenever MatchData's pickled columns change shape
+match_state_version = 1
+
+# The parts of match details that MatchData reads
+match_shape = {
+	"matchId": True,
+	"participants": [dict(dict.fromkeys(("participantId", "championId", "teamId", "highestAchievedSeasonTier", "spell1Id", "spell2Id"), True), timeline=frozenset(("lane",)))],
+	"participantIdentities": [{"participantId": True, "player": frozenset(("summonerId", "summonerName"))}]
+}
+
+def match_rows(json_obj):
+	"""
+	Pairs each participant identity in a match payload with its participant,
+	indexing the participants by id once instead of searching for each one
+	"""
+	by_id = dict((p["participantId"], p) for p in json_obj["participants"])
+	for identity in json_obj["participantIdentities"]:
+		participant = by_id.get(identity["participantId"])
+		if participant is not None:
+			yield identity["player"], participant
+
 class MatchData(JSONObject):
-	"""MatchData model object for working with data from the API. Treat this as readonly."""
+	"""
+	MatchData model object for working with data from the API. Treat this as readonly.
+	The participants are kept as parallel tuples, one entry each, and only
+	turned into MatchParticipant/MatchPlayer objects if someone asks for them.
+	"""
+	__slots__ = ("match_id", "summoner_ids", "summoner_names", "participant_ids", "champion_ids", "team_ids", "tiers", "spell_one_ids", "spell_two_ids", "lanes", "_index", "_participants", "_players")
+
 	def __init__(self, json_obj):
 		super(MatchData, self).__init__(json_obj)
-		self.participants = {}
-		self.players = []
-		participants = json_obj["participants"]
-		participant_ids = json_obj["participantIdentities"]
-		for participant_id in participant_ids:
-			player = MatchPlayer(participant_id["player"])
-			self.players.append(player)
-
-			participant = filter(lambda p: p["participantId"] == participant_id["participantId"], participants)
-			if participant is not None:
-				participant = MatchParticipant(participant[0])
-				summoner_id = participant_id["player"]["summonerId"]
-				self.participants[summoner_id] = participant
+		self.match_id = json_obj.get("matchId")
+		columns = ([], [], [], [], [], [], [], [], [])
+		for player, participant in match_rows(json_obj):
+			columns[0].append(player["summonerId"])
+			columns[1].append(player["summonerName"])
+			columns[2].append(participant["participantId"])
+			columns[3].append(participant["championId"])
+			columns[4].append(participant["teamId"])
+			columns[5].append(participant["highestAchievedSeasonTier"])
+			columns[6].append(participant["spell1Id"])
+			columns[7].append(participant["spell2Id"])
+			columns[8].append(participant.get("timeline", {}).get("lane"))
+		self._set_columns(*columns)
+
+	def _set_columns(self, summoner_ids, summoner_names, participant_ids, champion_ids, team_ids, tiers, spell_one_ids, spell_two_ids, lanes):
+		self.summoner_ids = tuple(summoner_ids)
+		self.summoner_names = tuple(summoner_names)
+		self.participant_ids = tuple(participant_ids)
+		self.champion_ids = tuple(champion_ids)
+		self.team_ids = tuple(team_ids)
+		self.tiers = tuple(tiers)
+		self.spell_one_ids = tuple(spell_one_ids)
+		self.spell_two_ids = tuple(spell_two_ids)
+		self.lanes = tuple(lanes)
+		self._index = None
+		self._participants = None
+		self._players = None
+
+	def __getstate__(self):
+		return {
+			"version": match_state_version,
+			"match_id": self.match_id,
+			"columns": (self.summoner_ids, self.summoner_names, self.participant_ids, self.champion_ids, self.team_ids, self.tiers, self.spell_one_ids, self.spell_two_ids, self.lanes)
+		}
+
+	def __setstate__(self, state):
+		if not isinstance(state, dict) or state.get("version") != match_state_version:
+			# The cache treats this as a miss and fetches the match again
+			raise ValueError("MatchData was cached in an older layout")
+		self.json = None
+		self.match_id = state["match_id"]
+		self._set_columns(*state["columns"])
+
+	def position(self, summoner_id):
+		"""Where the summoner is in the columns. Raises KeyError if they weren't in the match."""
+		if self._index is None:
+			self._index = dict((s_id, i) for i, s_id in enumerate(self.summoner_ids))
+		return self._index[summoner_id]
+
+	def tier_for(self, summoner_id):
+		"""The summoner's highest achieved tier, without decoding anyone else"""
+		return self.tiers[self.position(summoner_id)]
+
+	def participant(self, summoner_id):
+		"""Just the one summoner's participant"""
+		i = self.position(summoner_id)
+		return MatchParticipant({
+			"spell1Id": self.spell_one_ids[i],
+			"spell2Id": self.spell_two_ids[i],
+			"participantId": self.participant_ids[i],
+			"championId": self.champion_ids[i],
+			"teamId": self.team_ids[i],
+			"highestAchievedSeasonTier": self.tiers[i]
+		})
+
+	@property
+	def participants(self):
+		"""Summoner id -> MatchParticipant for everyone in the match"""
+		if self._participants is None:
+			self._participants = dict((summoner_id, self.participant(summoner_id)) for summoner_id in self.summoner_ids)
+		return self._participants
+
+	@property
+	def players(self):
+		if self._players is None:
+			self._players = [MatchPlayer({"summonerId": s_id, "summonerName": name}) for s_id, name in zip(self.summoner_ids, self.summoner_names)]
+		return self._players
 
 class MatchParticipant(JSONObject):
 	"""MatchParticipant model object for working with data from the API. Treat this as readonly."""
+	__slots__ = ("spell_one_id", "spell_two_id", "participant_id", "champion_id", "team_id", "highest_achieved_season_tier")
+
 	def __init__(self, json_obj):
 		super(MatchParticipant, self).__init__(json_obj)
 		self.spell_one_id = json_obj["spell1Id"]
@@ -440,6 +2696,8 @@ class MatchParticipant(JSONObject):
 
 class MatchPlayer(JSONObject):
 	"""MatchPlayer model object for working with data from the API. Treat this as readonly."""
+	__slots__ = ("summoner_id", "summoner_name")
+
 	def __init__(self, json_obj):
 		super(MatchPlayer, self).__init__(json_obj)
 		self.summoner_id = json_obj["summonerId"]
@@ -447,6 +2705,8 @@ class MatchPlayer(JSONObject):
 
 class Champion(JSONObject):
 	"""Champion model object for working with data from the API. Treat this as readonly."""
+	__slots__ = ("c_id", "title", "name", "key", "square_url", "loading_url", "ally_tips", "enemy_tips_tips", "blurb", "lore", "info", "tags")
+
 	def __init__(self, json_obj):
 		super(Champion, self).__init__(json_obj)
 		self.c_id = json_obj["id"]
@@ -457,8 +2717,9 @@ class Champion(JSONObject):
 		# This makes things a little bit more accessible on the frontend.
 		self.square_url = "https://ddragon.leagueoflegends.com/cdn/6.8.1/img/champion/{key}.png".format(key=self.key)
 		self.loading_url = "http://ddragon.leagueoflegends.com/cdn/img/champion/loading/{key}_0.jpg".format(key=self.key)
-		self.json["squareUrl"] = self.square_url
-		self.json["loadingUrl"] = self.loading_url
+		if self.json is not None:
+			self.json["squareUrl"] = self.square_url
+			self.json["loadingUrl"] = self.loading_url
 
 		if "allytips" in json_obj:
 			self.ally_tips = json_obj["allytips"]
@@ -484,6 +2745,8 @@ class Champion(JSONObject):
 
 class Summoner(JSONObject):
 	"""Summoner model object for working with data from the API. Treat this as readonly."""
+	__slots__ = ("s_id", "name", "profile_icon_id", "revision_date", "summoner_level", "profile_icon_url", "_highest_rank", "_masteries", "_matches", "_classifications", "_dirty")
+
 	def __init__(self, json_obj):
 		super(Summoner, self).__init__(json_obj)
 		self.s_id = json_obj["id"]
@@ -493,27 +2756,66 @@ class Summoner(JSONObject):
 		self.summoner_level = json_obj["summonerLevel"]
 
 		self.profile_icon_url = "http://ddragon.leagueoflegends.com/cdn/6.9.1/img/profileicon/{pid}.png".format(pid=self.profile_icon_id)
-		self.json["profileIconUrl"] = self.profile_icon_url
+		if self.json is not None:
+			self.json["profileIconUrl"] = self.profile_icon_url
 
 		# Non-json private vars
 		self._highest_rank = None
 		self._masteries = None
 		self._matches = None
 		self._classifications = None
+		self._dirty = False
+
+	def __getstate__(self):
+		"""
+		Only the summoner's own fields and what we've worked out about them get
+		pickled. Raw JSON, matches and masteries are cached on their own.
+		"""
+		return {
+			"version": summoner_state_version,
+			"s_id": self.s_id,
+			"name": self.name,
+			"profile_icon_id": self.profile_icon_id,
+			"revision_date": self.revision_date,
+			"summoner_level": self.summoner_level,
+			"highest_rank": self._highest_rank,
+			"classifications": self._classifications
+		}
+
+	def __setstate__(self, state):
+		self.json = None
+		self.s_id = state["s_id"]
+		self.name = state["name"]
+		self.profile_icon_id = state["profile_icon_id"]
+		self.revision_date = state["revision_date"]
+		self.summoner_level = state["summoner_level"]
+		self.profile_icon_url = "http://ddragon.leagueoflegends.com/cdn/6.9.1/img/profileicon/{pid}.png".format(pid=self.profile_icon_id)
+
+		self._highest_rank = None
+		self._masteries = None
+		self._matches = None
+		self._classifications = None
+		self._dirty = False
+
+		# Anything we worked out with an older version of the code gets worked out again
+		if state.get("version") == summoner_state_version:
+			self._highest_rank = state["highest_rank"]
+			self._classifications = state["classifications"]
 
 	@property
 	def highest_rank(self):
 		"""Summoners highest rank"""
-		for match in self.matches:
-			return match.match_data.participants[self.s_id].highest_achieved_season_tier
+		if self._highest_rank is None:
+			for match in prefetch_matches(self, limit=1, champions=False):
+				self._highest_rank = match.match_data.tier_for(self.s_id)
+				self._dirty = True
+		return self._highest_rank
 
 	@property
 	def masteries(self):
 		"""Masteries for the current summoner"""
 		if self._masteries is None:
 			self._masteries = get_masteries(self.s_id)
-		if get_arg("cache"):
-			cache.set("summ-" + normalize_name(self.name), self)
 		return self._masteries
 
 	@property
@@ -521,8 +2823,6 @@ class Summoner(JSONObject):
 		"""Matches for the current summoner"""
 		if self._matches is None:
 			self._matches = get_match_list(self.s_id) 
-		if get_arg("cache"):
-			cache.set("summ-" + normalize_name(self.name), self)
 		return self._matches
 
 	@property
@@ -531,74 +2831,30 @@ class Summoner(JSONObject):
 		Gets the classifications for the current player.
 		"""
 		if self._classifications is None:
-			# We're going to average the skill in each category
-			# of champion i.e. fighter, support, etc.
-
-			# We need to build a mapping of how players
-			# play their champions. This will help us make
-			# the final decision as to where they should be
-			# placed in their team.
-			champion_mapping = {}
-			champion_lane_mapping = map(lambda m: (m.match_champion.name, m.lane), self.matches)
-			for lane_mapping in champion_lane_mapping:
-				champ = lane_mapping[0]
-				lane = lane_mapping[1]
-
-				# Get the basic stuff in so we can build this
-				if champ not in champion_mapping:
-					champion_mapping[champ] = {}
-				if lane not in champion_mapping[champ]:
-					champion_mapping[champ][lane] = 0
-
-				champion_mapping[champ][lane] += 1
-
-			# Make it easier to get everything together.
-			# Don't worry we make it awful right after this.
-			start = epoch_time()
-			bins = {}
-			for mastery in self.masteries:
-				for bin_type in mastery.champion.tags:
-					if bin_type not in bins:
-						bins[bin_type] = {"classification": bin_type, "champions": [], "score": 0, "overall_level": 0}
-
-					lanes = None
-					if mastery.champion.name in champion_mapping:
-						lanes = [{"lane": lane, "count": count} for lane, count in champion_mapping[mastery.champion.name].iteritems()]
-					else: 
-						lanes = []
-
-					bins[bin_type]["champions"].append(
-						{
-							"name": mastery.champion.name, 
-							"score": mastery.champion_points, 
-							"lanes": lanes
-						})
-					bins[bin_type]["score"] += mastery.champion_points
-					bins[bin_type]["overall_level"] += mastery.champion_level
-
-			# Going to rejam everything in here. I blame myself.
-			start = epoch_time()
-			classifications = []
-			for b_type, data in bins.iteritems():
-				# Maintain order on each champion
-				data["champions"].sort(key=lambda c: c["score"], reverse=True)
-				for champion in data["champions"]:
-					champion["lanes"].sort(key=lambda l: l["count"], reverse=True)
-				classifications.append(data)
-
-			# We also want to maintain order on each type
-			classifications.sort(key=lambda c: c["score"], reverse=True)
-
-			self._classifications = classifications
-
-		# Re-cache at this point. We've done a very expensive bit of work.
-		# Though as stated earlier I blame myself.
-		if get_arg("cache"):
-			cache.set("summ-" + normalize_name(self.name), self)
+			# We keep a running tally of how this player plays so we only
+			# have to look at what's changed since the last time we saw them.
+			state = riot_cache.get("classification", self.s_id)
+			if state is None or state.version != classification_state_version:
+				state = ClassificationState()
+			else:
+				# Whatever's in the cache could be shared with other threads
+				state = state.copy()
+
+			with metrics.timer("classification_duration_ms"):
+				state.update(self.matches, self.masteries)
+				riot_cache.set("classification", self.s_id, state)
+				self._classifications = state.classifications()
+
+			# We've done a very expensive bit of work so this needs re-caching.
+			# Though as stated earlier I blame myself.
+			self._dirty = True
+
 		return self._classifications
 
 class Mastery(JSONObject):
 	"""Mastery model object for working with data from the API. Treat this as readonly."""
+	__slots__ = ("champion_points", "player_id", "champion_points_until_next_level", "chest_granted", "champion_level", "champion_id", "champion_points_since_last_level", "last_play_time", "_champion")
+
 	def __init__(self, json_obj):
 		super(Mastery, self).__init__(json_obj)
 		self.champion_points = json_obj["championPoints"]
@@ -646,79 +2902,91 @@ Routes
 @app.route("/api/debug/<username>", methods=["POST", "GET"])
 def debug_create_player(username):
 	summoner = name_to_summoner(username)
-	return make_success(response={"value": summoner.classifications})
+	classifications = summoner.classifications
+	return make_success(response={"value": classifications, "cached_bytes": store_summoner(summoner, measure=True)})
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics_endpoint():
+	if not metrics.enabled:
+		return make_error(error={"message": "Metrics are turned off, start the API with --metrics."}, response_code=404)
+
+	counters = []
+	gauges = []
+	cache_stats = riot_cache.stats()
+	for kind in cache_kinds:
+		stats = cache_stats[kind]
+		for result in ("local_hits", "remote_hits", "misses", "coalesced", "remote_errors"):
+			counters.append((("riot_cache_lookups_total", (("kind", kind), ("result", result))), stats[result]))
+		gauges.append((("riot_cache_hit_ratio", (("kind", kind),)), stats["hit_ratio"]))
+
+	# Each budget can have several windows, so label them by their length too
+	for name, buckets in rate_limiter.stats().iteritems():
+		for bucket in buckets:
+			labels = (("bucket", name), ("window", "{0}s".format(bucket["period"])))
+			counters.append((("riot_rate_limit_waits_total", labels), bucket["waits"]))
+			counters.append((("riot_rate_limit_wait_ms_total", labels), bucket["wait_ms"]))
+			counters.append((("riot_rate_limit_rejections_total", labels), bucket["rejections"]))
+			gauges.append((("riot_rate_limit_tokens", labels), bucket["tokens"]))
+			gauges.append((("riot_rate_limit_queued", labels), bucket["queued"]))
+
+	return Response(metrics.render(counters, gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/debug/ratelimits", methods=["GET"])
+def debug_rate_limits():
+	return make_success(response=rate_limiter.stats())
+
+@app.route("/api/debug/connections", methods=["GET"])
+def debug_connections():
+	return make_success(response=connection_stats())
+
+@app.route("/api/debug/requests", methods=["GET"])
+def debug_requests():
+	return make_success(response=in_flight.stats())
+
+@app.route("/api/debug/cache", methods=["GET"])
+def debug_cache():
+	return make_success(response=riot_cache.stats())
+
+@app.route("/api/debug/db", methods=["GET"])
+def debug_db():
+	return make_success(response=dict((path, pool.stats()) for path, pool in _db_pools.items()))
+
+@app.route("/api/debug/matchmaking", methods=["GET"])
+def debug_matchmaking():
+	stats = {"open_teams": len(matchmaking_index())}
+	if matchmaking_scheduler is not None:
+		stats.update(matchmaking_scheduler.stats())
+	return make_success(response=stats)
+
+@app.route("/api/debug/jobs", methods=["GET"])
+def debug_jobs():
+	return make_success(response=profile_broker.stats() if profile_broker is not None else {})
 
 @app.route("/api/debug/populate/<username>", methods=["POST", "GET"])
 def populate_db(username):
-	summoner = name_to_summoner(username)
-
-	if summoner is None:
-		return make_error(error={"message": "Could not find summoner."})
-
-	summoner_ids = []
-	for idx, match in enumerate(summoner.matches):
-		# We're only going to index four matches, should be around 40 players
-		# (the limit on how many summoner IDs you can pass into the endpoint)
-		# XXX: This just destroyed my rate limit... >.>
-		if idx == 3:
-			break
-
-		for player in match.match_data.players:
-			summoner_ids.append(player.summoner_id)
-
-	summoners = ids_to_summoners(summoner_ids)
-
-	map(lambda s: create_player(s), summoners)
-
-	return make_success(response={"message": "Done Populating"})
+	"""
+	Crawls out from the summoner (or comma separated summoners) adding
+	players. Progress comes back as a line of JSON per batch.
+	"""
+	progress = crawl(
+		username.split(","),
+		max_depth=request.args.get("depth", 1, type=int),
+		max_players=request.args.get("max", 100, type=int),
+		matches_per_summoner=request.args.get("matches", 3, type=int),
+		batch_size=request.args.get("batch", 50, type=int)
+	)
+	lines = (json.dumps(report) + "\n" for report in progress)
+	return Response(stream_with_context(lines), mimetype="application/x-ndjson")
 
 @app.route("/api/joinateam/<username>", methods=["POST", "GET"])
 def join_a_team(username):
-	db = get_db()
-	cur = db.cursor()
-
 	name = normalize_name(username)
 	summoner = name_to_summoner(name)
 
 	if summoner is None:
 		return make_error(error={"message": "Could not find summoner."})
 
-	# We're going to open up a new player request
-	player_request = create_player_request(summoner)
-	player = query_db('''SELECT p.* FROM player p JOIN player_req pr ON pr.player_id = p.id WHERE pr.id = ?''', [player_request], one=True)
-
-	# Then we're gonna see if we can close this req as fast as possible
-	# Quick check to see how many teams there are that are still open
-	teams = query_db('''SELECT t.* FROM team t JOIN players_teams pt ON pt.team_id = t.id JOIN player p ON p.id = pt.player_id WHERE finish_time IS NULL AND pt.leader = 1 AND p.highest_rank = ?''', [player["highest_rank"]])
-	if len(teams) == 0:
-		return make_success(response={"message": "No teams just yet, but you're on the list!"})
-	else:
-		# There may be a compatible team available so start closer examination
-		for row in teams:
-			query_sql = '''SELECT p.best_position AS best FROM player p JOIN players_teams pt ON pt.player_id = p.id WHERE pt.team_id = ?'''
-			current_positions_filled = query_db(query_sql, [row["id"]])
-			collision = False
-
-			# Scan for collisions
-			for position_row in current_positions_filled:
-				player_data = player["best_position"].split()
-				player_lane = player_data[0]
-				player_position = player_data[1]
-				other_data = position_row["best"].split()
-				other_lane = other_data[0]
-				other_position = other_data[1]
-				if player_lane == other_lane and player_position == other_position:
-					if player_lane != "BOTTOM":
-						collision = True
-
-			# If we don't have one then we can put them on this team
-			if not collision:
-				join_team(player["id"], player_request, row["id"])
-			else:
-				return make_success(response="No teams just yet, but you're on the list!")
-
-		return make_success(response="WE FOUND YOU A TEAM!")
-
+	return run_for_summoner(summoner, "join")
 
 @app.route("/api/makeateam/<username>", methods=["POST", "GET"])
 def make_a_team(username):
@@ -729,26 +2997,14 @@ def make_a_team(username):
 	if summoner is None:
 		return make_error(error={"message": "Could not find summoner."})
 	
-	if check_summoner_searching(summoner):
-		# If the current summoner is building a team, we're going to return an error
-		return make_error(error={"message": "You're already building a team!"}, response_code=200)
-
-	# If they're not actively leading a team, create a new one and insert them as the leader
-	create_team(summoner)
-	return make_success(response={"leader": summoner.name})
-
-"""
-===============================
-Cache
-===============================
-"""
+	return run_for_summoner(summoner, "make")
 
-if args and args.cache:
-	# Warms up our caches.
-	# Load the champion cache file.
-	champs = json.loads(open("cache/champions.json").read())["data"]
-	for champ in champs.values():
-		cache.set("champ-" + str(champ["id"]), Champion(champ))
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+	job = profile_broker.status(job_id) if profile_broker is not None else None
+	if job is None:
+		return make_error(error={"message": "Could not find that job."}, response_code=404)
+	return make_success(response=job)
 
 """
 ===============================
@@ -757,15 +3013,44 @@ Startup
 """
 
 def main():
+	global matchmaking_scheduler
+
 	# Stop wasting so much space
 	app.config.update(
 		JSONIFY_PRETTYPRINT_REGULAR=False
 	)
 
+	if args.record is not None or args.replay is not None:
+		use_recorder(Recorder(args.replay or args.record, replay=args.replay is not None))
+
+	if args.storage == "sqlite":
+		migrate_db()
+	with app.app_context():
+		matchmaking_index()
+
+	if args.matchmaking_interval > 0:
+		matchmaking_scheduler = MatchmakingScheduler(args.matchmaking_interval)
+		matchmaking_scheduler.start()
+
+	if args.profile_workers > 0:
+		start_profile_workers(LocalBroker(), args.profile_workers)
+
+	if args.cache:
+		# Warms up our caches before we take any requests.
+		champion_index()
+
 	if args.public:
 		app.run(host="0.0.0.0", debug=args.debug, threaded=args.thread)
 	else:
 		app.run(debug=args.debug, threaded=args.thread)
 
+# Pre-forking servers like uWSGI or gunicorn --preload import this module and
+# fork their workers from it without ever calling main(). Loading a compiled
+# champion artifact here means those workers share it instead of each
+# building their own index. Set NO_CHAMPION_PRELOAD to leave it until the
+# first lookup, like bench.py startup does to time each way of loading.
+if args is None and not os.environ.get("NO_CHAMPION_PRELOAD") and _artifact_is_fresh():
+	preload_champion_index()
+
 if __name__ == '__main__':
 	main()
\ No newline at end of file
@@ -0,0 +1,9 @@
+-- Indexes for the lookups every route makes.
+CREATE INDEX players_teams_team ON players_teams (team_id);
+CREATE INDEX players_teams_player_leader ON players_teams (player_id, leader);
+CREATE INDEX player_rank ON player (highest_rank);
+
+-- Open requests and teams are a small slice of each table, so only index those.
+CREATE INDEX player_req_open_player ON player_req (player_id) WHERE finish_time IS NULL;
+CREATE INDEX player_req_open_created ON player_req (create_time, id) WHERE finish_time IS NULL;
+CREATE INDEX team_open ON team (id) WHERE finish_time IS NULL;
@@ -0,0 +1,10 @@
+-- Keep the leader's tier and how many players a team has on the team itself
+-- so matchmaking doesn't have to join through players_teams to find them.
+ALTER TABLE team ADD COLUMN leader_tier TEXT;
+ALTER TABLE team ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE team SET
+  member_count = (SELECT count(*) FROM players_teams pt WHERE pt.team_id = team.id),
+  leader_tier = (SELECT p.highest_rank FROM players_teams pt JOIN player p ON p.id = pt.player_id WHERE pt.team_id = team.id AND pt.leader = 1);
+
+CREATE INDEX team_open_tier ON team (leader_tier, member_count) WHERE finish_time IS NULL;
@@ -0,0 +1,8 @@
+-- A player can only have one open request at a time. Close out any extras
+-- left over from races so the unique index can go on.
+UPDATE player_req SET finish_time = create_time
+  WHERE finish_time IS NULL
+  AND id NOT IN (SELECT max(id) FROM player_req WHERE finish_time IS NULL GROUP BY player_id);
+
+DROP INDEX player_req_open_player;
+CREATE UNIQUE INDEX player_req_open_player ON player_req (player_id) WHERE finish_time IS NULL;
@@ -0,0 +1,43 @@
+"""
+Seeds the database by crawling out from a few summoners through the people
+they've played with. Run from the backend folder:
+
+	python populate.py -k <api-key> "Summoner One" "Summoner Two"
+
+Point --riot-url at a mock Riot server to try it without using up a real key.
+"""
+
+from argparse import ArgumentParser
+import json
+import os
+
+import main
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description="Crawls the Riot API for players to fill the database with")
+	parser.add_argument("seeds", nargs="+", help="summoner names to start from")
+	parser.add_argument("-k", "--api-key", dest="api_key", default="", help="the Riot API key")
+	parser.add_argument("--depth", dest="depth", type=int, default=2, help="how many matches away from the seeds to go")
+	parser.add_argument("--max-players", dest="max_players", type=int, default=500, help="stop after this many summoners")
+	parser.add_argument("--matches", dest="matches", type=int, default=3, help="how many of each summoner's matches to look through for more")
+	parser.add_argument("--batch-size", dest="batch_size", type=int, default=50, help="how many players to insert per transaction")
+	parser.add_argument("--riot-url", dest="riot_url", default=None, help="talk to this server instead of the Riot API")
+	parser.add_argument("--database", dest="database", default=main.database_url, help="the SQLite database to fill")
+	options = parser.parse_args()
+
+	main.set_api_key(options.api_key)
+	if options.riot_url is not None:
+		main.base_url = main.static_base_url = options.riot_url.rstrip("/")
+		# A stand-in server doesn't have budgets to stay under
+		main.rate_limiter = main.RateLimiter({})
+
+	main.database_url = options.database
+	if os.path.exists(options.database):
+		main.migrate_db()
+	else:
+		main.init_db()
+
+	with main.app.app_context():
+		for report in main.crawl(options.seeds, max_depth=options.depth, max_players=options.max_players,
+				matches_per_summoner=options.matches, batch_size=options.batch_size):
+			print(json.dumps(report, sort_keys=True))
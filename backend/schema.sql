@@ -1,3 +1,5 @@
+PRAGMA user_version = 0;
+
 DROP TABLE IF EXISTS team;
 DROP TABLE IF EXISTS player;
 DROP TABLE IF EXISTS players_teams;
@@ -29,4 +31,6 @@ CREATE TABLE player_req(
   team_id INTEGER,
   create_time INTEGER NOT NULL,
   finish_time INTEGER
-);
\ No newline at end of file
+);
+
+-- Everything after this lives in migrations/ and is applied by migrate_db()
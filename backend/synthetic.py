@@ -0,0 +1,150 @@
+"""
+Made up Riot API payloads, shaped like the real ones. fake_riot serves them,
+bench and the tests build models straight from them. Everything draws from
+the shared random module, so seed it for repeatable data. Also starts apps
+on a local server for the benchmarks and tests to call.
+"""
+
+from werkzeug.serving import make_server
+from werkzeug.serving import WSGIRequestHandler
+import threading
+import random
+import json
+import os
+
+champions_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "champions.json")
+
+"""
+===============================
+Riot Payloads
+===============================
+"""
+
+tiers = ["UNRANKED", "BRONZE", "SILVER", "GOLD", "PLATINUM", "DIAMOND", "MASTER", "CHALLENGER"]
+lanes = ["TOP", "JUNGLE", "MID", "BOTTOM"]
+roles = ["SOLO", "NONE", "DUO_CARRY", "DUO_SUPPORT"]
+
+def load_champions():
+	"""Loads the raw champion data we ship with"""
+	with open(champions_file) as f:
+		return json.loads(f.read())["data"].values()
+
+def summoner(summoner_id):
+	return {
+		"id": summoner_id,
+		"name": "Summoner {0}".format(summoner_id),
+		"profileIconId": summoner_id % 1000,
+		"revisionDate": 1462000000000 + summoner_id,
+		"summonerLevel": 30
+	}
+
+def match_reference(match_id, champion_id):
+	return {
+		"timestamp": 1462000000000 + match_id,
+		"champion": champion_id,
+		"region": "NA",
+		"queue": "TEAM_BUILDER_DRAFT_RANKED_5x5",
+		"season": "SEASON2016",
+		"matchId": match_id,
+		"role": random.choice(roles),
+		"platformId": "NA1",
+		"lane": random.choice(lanes)
+	}
+
+def match(match_id, summoner_ids, champion_ids):
+	"""Builds a match detail payload with roughly the shape (and bulk) of the real thing"""
+	participants = []
+	identities = []
+	for idx, summoner_id in enumerate(summoner_ids):
+		participant_id = idx + 1
+		stats = dict(("stat{0}".format(s), random.randint(0, 50000)) for s in range(60))
+		participants.append({
+			"participantId": participant_id,
+			"teamId": 100 if idx < 5 else 200,
+			"championId": champion_ids[idx],
+			"spell1Id": 4,
+			"spell2Id": 14,
+			"highestAchievedSeasonTier": random.choice(tiers),
+			"stats": stats,
+			"masteries": [{"masteryId": 6000 + m, "rank": 1} for m in range(15)],
+			"runes": [{"runeId": 5000 + r, "rank": 9} for r in range(4)],
+			"timeline": {"lane": random.choice(lanes), "role": random.choice(roles)}
+		})
+		identities.append({
+			"participantId": participant_id,
+			"player": {
+				"summonerId": summoner_id,
+				"summonerName": "Summoner {0}".format(summoner_id),
+				"profileIcon": summoner_id % 1000,
+				"matchHistoryUri": "/v1/stats/player_history/NA1/{0}".format(summoner_id)
+			}
+		})
+
+	return {
+		"matchId": match_id,
+		"region": "NA",
+		"platformId": "NA1",
+		"matchMode": "CLASSIC",
+		"matchType": "MATCHED_GAME",
+		"matchCreation": 1462000000000 + match_id,
+		"matchDuration": 1800,
+		"queueType": "TEAM_BUILDER_DRAFT_RANKED_5x5",
+		"mapId": 11,
+		"season": "SEASON2016",
+		"matchVersion": "6.9.0.1",
+		"participants": participants,
+		"participantIdentities": identities,
+		"teams": [{"teamId": 100, "winner": True}, {"teamId": 200, "winner": False}]
+	}
+
+def mastery(summoner_id, champion_id):
+	return {
+		"championPoints": random.randint(100, 200000),
+		"playerId": summoner_id,
+		"championPointsUntilNextLevel": 0,
+		"chestGranted": False,
+		"championLevel": random.randint(1, 5),
+		"championId": champion_id,
+		"championPointsSinceLastLevel": 0,
+		"lastPlayTime": 1462000000000
+	}
+
+def timeline(participants=10, minutes=35, events=20):
+	"""The per minute frames a match detail has with includeTimeline, the bulk of a real one"""
+	frames = []
+	for minute in range(minutes):
+		frames.append({
+			"timestamp": minute * 60000,
+			"participantFrames": dict((str(p), {
+				"participantId": p,
+				"position": {"x": random.randint(0, 15000), "y": random.randint(0, 15000)},
+				"currentGold": random.randint(0, 5000),
+				"totalGold": random.randint(0, 20000),
+				"level": random.randint(1, 18),
+				"xp": random.randint(0, 20000),
+				"minionsKilled": random.randint(0, 300),
+				"jungleMinionsKilled": random.randint(0, 100),
+				"dominionScore": 0,
+				"teamScore": 0
+			}) for p in range(1, participants + 1)),
+			"events": [{"eventType": "ITEM_PURCHASED", "timestamp": minute * 60000 + e, "participantId": random.randint(1, participants), "itemId": 1001} for e in range(events)]
+		})
+	return {"frameInterval": 60000, "frames": frames}
+
+"""
+===============================
+Serving
+===============================
+"""
+
+class QuietRequestHandler(WSGIRequestHandler):
+	def log_request(self, *args):
+		pass
+
+def serve_in_background(app):
+	"""Starts the app on a real threaded server and returns it and its URL"""
+	server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietRequestHandler)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server, "http://127.0.0.1:{0}".format(server.server_port)
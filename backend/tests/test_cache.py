@@ -0,0 +1,139 @@
+"""
+Checks the models go through Redis the way werkzeug's RedisCache pickles
+them, and that the Riot cache copes with what older versions left behind.
+"""
+
+import unittest
+
+from werkzeug.contrib.cache import RedisCache
+
+import main
+import synthetic
+
+class PickledRemote(object):
+	"""Stands in for Redis, storing and loading values the same way werkzeug's RedisCache does"""
+	def __init__(self):
+		super(PickledRemote, self).__init__()
+		self.values = {}
+
+	def get(self, key):
+		return RedisCache.load_object.__func__(None, self.values.get(key))
+
+	def set(self, key, value, timeout=None):
+		self.values[key] = RedisCache.dump_object.__func__(None, value)
+
+	def delete(self, key):
+		self.values.pop(key, None)
+
+def old_pickle(cls_name, attributes):
+	"""Pickles an object the way the old dict based models were, before they had slots"""
+	current = getattr(main, cls_name)
+	old = type(cls_name, (object,), {"__module__": "main"})
+	instance = old()
+	instance.__dict__.update(attributes)
+	setattr(main, cls_name, old)
+	try:
+		return RedisCache.dump_object.__func__(None, instance)
+	finally:
+		setattr(main, cls_name, current)
+
+def vars_of(obj):
+	"""The public slots an object has set, to compare models by"""
+	return dict((slot, getattr(obj, slot)) for cls in type(obj).__mro__ for slot in getattr(cls, "__slots__", ())
+		if not slot.startswith("_") and slot != "json" and hasattr(obj, slot))
+
+class RemoteCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.remote = PickledRemote()
+		self.cache = main.LayeredCache(main.LRUCache(100), remote=self.remote)
+
+	def test_old_summoner_is_a_miss(self):
+		self.remote.values["summ-someone"] = old_pickle("Summoner", {"s_id": 1, "name": "Someone", "json": {}})
+		summoner = main.Summoner({"id": 1, "name": "Someone", "profileIconId": 1, "revisionDate": 1462000000000, "summonerLevel": 30})
+
+		self.assertEqual(self.cache.get_or_load("summoner", "someone", lambda: summoner), summoner)
+		self.assertEqual(self.cache.stats()["summoner"]["remote_errors"], 1)
+		# The old entry got replaced by one that loads
+		self.assertEqual(self.remote.get("summ-someone").name, "Someone")
+
+	def test_old_match_player_is_a_miss(self):
+		self.remote.values["match-5"] = old_pickle("MatchPlayer", {"summoner_id": 1, "summoner_name": "Someone"})
+		self.assertIsNone(self.cache.get("match", 5))
+		self.assertNotIn("match-5", self.remote.values)
+
+	def test_other_match_data_version_is_a_miss(self):
+		match = main.MatchData({"matchId": 5, "participants": [], "participantIdentities": []})
+		current = main.match_state_version
+		main.match_state_version = current - 1
+		try:
+			self.remote.set("match-5", match)
+		finally:
+			main.match_state_version = current
+		self.assertIsNone(self.cache.get("match", 5))
+		self.assertNotIn("match-5", self.remote.values)
+
+	def test_current_values_still_hit(self):
+		champion_ids = [c["id"] for c in synthetic.load_champions()][:5]
+		matches = [main.Match(synthetic.match_reference(i, c)) for i, c in enumerate(champion_ids)]
+		masteries = [main.Mastery(synthetic.mastery(7, c)) for c in champion_ids]
+		champions = [main.Champion(main.slim_champion(c)) for c in synthetic.load_champions()[:5]]
+		# Lazily looked up parts aren't cached along with them
+		matches[0]._champion = champions[0]
+		self.cache.set("matchlist", 7, matches)
+		self.cache.set("mastery", 7, masteries)
+		self.cache.set("champion", 7, champions)
+
+		fresh = main.LayeredCache(main.LRUCache(100), remote=self.remote)
+		self.assertEqual([vars_of(m) for m in fresh.get("matchlist", 7)], [vars_of(m) for m in matches])
+		self.assertEqual([vars_of(m) for m in fresh.get("mastery", 7)], [vars_of(m) for m in masteries])
+		self.assertEqual([vars_of(c) for c in fresh.get("champion", 7)], [vars_of(c) for c in champions])
+		self.assertIsNone(fresh.get("matchlist", 7)[0]._champion)
+		self.assertEqual(fresh.stats()["matchlist"]["remote_hits"], 1)
+
+	def test_match_participants_and_players_pickle(self):
+		match = main.MatchData(synthetic.match(5, range(1, 11), [c["id"] for c in synthetic.load_champions()][:10]))
+		for value in match.participants.values() + match.players:
+			self.remote.set("value", value)
+			self.assertEqual(vars_of(self.remote.get("value")), vars_of(value))
+
+class StoreSummonerTest(unittest.TestCase):
+	def setUp(self):
+		self.saved = main.riot_cache
+		self.remote = PickledRemote()
+		main.riot_cache = main.LayeredCache(main.LRUCache(100), remote=self.remote)
+
+	def tearDown(self):
+		main.riot_cache = self.saved
+
+	def worked_out(self):
+		summoner = main.Summoner({"id": 1, "name": "Someone", "profileIconId": 1, "revisionDate": 1462000000000, "summonerLevel": 30})
+		summoner._matches = [1, 2, 3]
+		summoner._masteries = [4]
+		summoner._classifications = [{"classification": "Mage"}]
+		summoner._dirty = True
+		return summoner
+
+	def test_local_copy_is_compact(self):
+		summoner = self.worked_out()
+		self.assertEqual(main.store_summoner(summoner), 0)
+
+		cached = main.riot_cache.local.get("summ-someone")
+		self.assertIsNot(cached, summoner)
+		self.assertIsNone(cached._matches)
+		self.assertIsNone(cached._masteries)
+		self.assertEqual(cached._classifications, [{"classification": "Mage"}])
+		# The one we were working with keeps what it fetched
+		self.assertEqual(summoner._matches, [1, 2, 3])
+
+	def test_measured_size_is_what_redis_holds(self):
+		size = main.store_summoner(self.worked_out(), measure=True)
+		self.assertEqual(size + 1, len(self.remote.values["summ-someone"]))
+		self.assertEqual(main.riot_cache.stats()["summoner"]["bytes_written"], size)
+
+	def test_local_summoners_expire_with_match_lists(self):
+		self.assertEqual(main.riot_cache._local_timeout("summoner", main.cache_kinds["summoner"]["ttl"]), main.cache_kinds["matchlist"]["ttl"])
+		self.assertEqual(main.riot_cache._local_timeout("summoner", main.cache_kinds["summoner"]["negative_ttl"]), main.cache_kinds["summoner"]["negative_ttl"])
+		self.assertEqual(main.riot_cache._local_timeout("match", 0), 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,60 @@
+"""
+Checks champion lookups keep working when the compiled artifact can't be used.
+"""
+
+from argparse import Namespace
+import unittest
+import tempfile
+import pickle
+import os
+
+import main
+
+class ChampionIndexTest(unittest.TestCase):
+	def setUp(self):
+		handle, self.artifact = tempfile.mkstemp(suffix=".bin")
+		os.close(handle)
+		self.saved = (main.args, main.champions_artifact, main._champion_index)
+		main.args = Namespace(cache=True)
+		main.champions_artifact = self.artifact
+		main._champion_index = None
+
+	def tearDown(self):
+		main.args, main.champions_artifact, main._champion_index = self.saved
+		os.remove(self.artifact)
+
+	def test_artifact_is_used(self):
+		main.compile_champions(target=self.artifact)
+		self.assertEqual(main.specific_champion(412).name, "Thresh")
+
+	def test_old_artifact_version_falls_back_to_json(self):
+		main.compile_champions(target=self.artifact)
+		with open(self.artifact, "rb") as f:
+			artifact = pickle.load(f)
+		artifact["version"] = main.champions_artifact_version - 1
+		with open(self.artifact, "wb") as f:
+			pickle.dump(artifact, f, pickle.HIGHEST_PROTOCOL)
+
+		self.assertEqual(main.specific_champion(412).name, "Thresh")
+		self.assertEqual(len(main.champion_index()), len(main.ChampionIndex.from_file()))
+
+	def test_broken_artifact_falls_back_to_json(self):
+		with open(self.artifact, "wb") as f:
+			f.write("not a pickle")
+		self.assertEqual(main.specific_champion(412).name, "Thresh")
+
+	def test_preload_fills_the_shared_index(self):
+		main.compile_champions(target=self.artifact)
+		main.preload_champion_index()
+		self.assertIsNotNone(main._champion_index)
+		self.assertIs(main.champion_index(), main._champion_index)
+		self.assertEqual(main.specific_champion(412).name, "Thresh")
+
+	def test_preload_of_broken_artifact_leaves_index_unbuilt(self):
+		with open(self.artifact, "wb") as f:
+			f.write("not a pickle")
+		main.preload_champion_index()
+		self.assertIsNone(main._champion_index)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,130 @@
+"""
+Checks the running ClassificationState gives the same classifications as
+counting every match and mastery from scratch did. Run from the backend
+folder:
+
+	python -m unittest discover -s tests -t .
+"""
+
+import unittest
+import random
+
+import main
+import synthetic
+
+lanes = ["TOP", "JUNGLE", "MID", "BOTTOM"]
+
+def original_classifications(matches, masteries):
+	"""The classifications every request used to work out, kept here to check against"""
+	champion_mapping = {}
+	for match in matches:
+		champ = match.match_champion.name
+		champion_mapping.setdefault(champ, {})
+		champion_mapping[champ][match.lane] = champion_mapping[champ].get(match.lane, 0) + 1
+
+	bins = {}
+	for mastery in masteries:
+		for bin_type in mastery.champion.tags:
+			if bin_type not in bins:
+				bins[bin_type] = {"classification": bin_type, "champions": [], "score": 0, "overall_level": 0}
+			lanes = [{"lane": lane, "count": count} for lane, count in champion_mapping.get(mastery.champion.name, {}).iteritems()]
+			bins[bin_type]["champions"].append({"name": mastery.champion.name, "score": mastery.champion_points, "lanes": lanes})
+			bins[bin_type]["score"] += mastery.champion_points
+			bins[bin_type]["overall_level"] += mastery.champion_level
+
+	classifications = []
+	for b_type, data in bins.iteritems():
+		data["champions"].sort(key=lambda c: c["score"], reverse=True)
+		for champion in data["champions"]:
+			champion["lanes"].sort(key=lambda l: l["count"], reverse=True)
+		classifications.append(data)
+	classifications.sort(key=lambda c: c["score"], reverse=True)
+	return classifications
+
+def make_matches(champion_lanes, newest=10 ** 12):
+	"""Match list entries, newest first, for (champion id, lane) pairs given newest first"""
+	matches = []
+	for number, (champion_id, lane) in enumerate(champion_lanes):
+		reference = synthetic.match_reference(number, champion_id)
+		reference["timestamp"] = newest - number
+		reference["lane"] = lane
+		matches.append(main.Match(reference))
+	return matches
+
+def make_masteries(points):
+	return [main.Mastery(dict(synthetic.mastery(1, champion_id), championPoints=p)) for champion_id, p in points]
+
+def random_player(rng, champion_ids):
+	pool = rng.sample(champion_ids, rng.randint(1, 6))
+	matches = make_matches([(rng.choice(pool), rng.choice(lanes)) for _ in range(rng.randint(1, 20))])
+	# Few distinct points so champions tie too
+	masteries = make_masteries([(champion_id, rng.choice([1000, 2000, 5000])) for champion_id in pool])
+	return matches, masteries
+
+class ClassificationStateTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		main._champion_index = main.ChampionIndex.from_file()
+		cls.champion_ids = sorted(c.c_id for c in main.champion_index().all())
+
+	def classify(self, *updates):
+		"""Runs the updates through one state the way returning players do"""
+		state = main.ClassificationState()
+		for matches, masteries in updates:
+			state = state.copy()
+			state.update(matches, masteries)
+		return state
+
+	def test_fresh_state_matches_original(self):
+		rng = random.Random(1)
+		for _ in range(300):
+			matches, masteries = random_player(rng, self.champion_ids)
+			self.assertEqual(self.classify((matches, masteries)).classifications(), original_classifications(matches, masteries))
+
+	def test_incremental_updates_match_original(self):
+		rng = random.Random(2)
+		for _ in range(300):
+			matches, masteries = random_player(rng, self.champion_ids)
+			# The older matches were all there was last time, newer ones showed up since
+			older = matches[len(matches) / 2:]
+			oldest = matches[len(matches) * 3 / 4:]
+			state = self.classify((oldest, masteries[:1]), (older, masteries), (matches, masteries))
+			self.assertEqual(state.classifications(), original_classifications(matches, masteries))
+
+	def test_tied_lanes_keep_original_order(self):
+		champion_id = self.champion_ids[0]
+		masteries = make_masteries([(champion_id, 1000)])
+		for first, second in [(a, b) for a in lanes for b in lanes if a != b]:
+			# Two games in each lane, the newer two in the second lane
+			matches = make_matches([(champion_id, second), (champion_id, second), (champion_id, first), (champion_id, first)])
+			expected = original_classifications(matches, masteries)
+			self.assertEqual(self.classify((matches[2:], masteries), (matches, masteries)).classifications(), expected)
+			self.assertEqual(self.classify((matches[3:], masteries), (matches[1:], masteries), (matches, masteries)).classifications(), expected)
+
+	def test_changed_masteries_match_original(self):
+		rng = random.Random(3)
+		for _ in range(100):
+			matches, masteries = random_player(rng, self.champion_ids)
+			grown = make_masteries([(m.champion_id, m.champion_points + rng.choice([0, 500])) for m in masteries[1:]])
+			state = self.classify((matches, masteries), (matches, grown))
+			self.assertEqual(state.classifications(), original_classifications(matches, grown))
+
+	def test_batch_of_players_through_the_cache(self):
+		rng = random.Random(4)
+		players = [random_player(rng, self.champion_ids) for _ in range(100)]
+		saved = main.riot_cache
+		main.riot_cache = main.LayeredCache(main.LRUCache(1000))
+		try:
+			# The whole batch is seen with their older matches, then again
+			# with everything, sharing one cache like a crawl does
+			for recent in (False, True):
+				for summoner_id, (matches, masteries) in enumerate(players, 1):
+					summoner = main.Summoner(synthetic.summoner(summoner_id))
+					summoner._matches = matches if recent else matches[len(matches) / 2:]
+					summoner._masteries = masteries
+					self.assertEqual(summoner.classifications, original_classifications(summoner._matches, masteries))
+		finally:
+			main.riot_cache = saved
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,77 @@
+"""
+Runs the crawler against fake_riot on a local server, including a seed the
+Riot API has no match list for.
+"""
+
+import unittest
+import json
+
+import main
+import synthetic
+import fake_riot
+
+class NoHistoryRiot(fake_riot.SyntheticRiot):
+	"""Summoners in no_history exist but have never played ranked, so their match lists 404"""
+	no_history = set([1])
+
+	def match_list(self, summoner_id):
+		if summoner_id in self.no_history:
+			return None
+		return super(NoHistoryRiot, self).match_list(summoner_id)
+
+class CrawlTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		main._champion_index = main.ChampionIndex.from_file()
+		cls.server, cls.url = synthetic.serve_in_background(fake_riot.make_app(NoHistoryRiot(population=200, matches=3)))
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+
+	def setUp(self):
+		self.saved = (main.base_url, main.static_base_url, main.rate_limiter, main.riot_cache)
+		main.base_url = main.static_base_url = self.url
+		main.rate_limiter = main.RateLimiter({})
+		main.riot_cache = main.LayeredCache(main.LRUCache(10000))
+		main.set_storage(main.InMemoryStorage())
+
+	def tearDown(self):
+		main.base_url, main.static_base_url, main.rate_limiter, main.riot_cache = self.saved
+		main.set_storage(None)
+
+	def test_crawl_reaches_everyone_and_finishes(self):
+		with main.app.app_context():
+			reports = list(main.crawl(["Summoner 2", "Summoner 3"], max_depth=2, max_players=40, batch_size=10))
+
+		final = reports[-1]
+		self.assertTrue(final["done"])
+		self.assertFalse(any(report["done"] for report in reports[:-1]))
+		self.assertEqual(final["processed"], 40)
+		self.assertEqual(final["inserted"] + final.get("failed", 0) + final.get("existing", 0), final["processed"])
+		self.assertEqual(len(main.storage().pending_requests()), 0)
+		self.assertIsNotNone(main.storage().find_player("Summoner 2"))
+
+	def test_seed_without_match_list(self):
+		with main.app.app_context():
+			reports = list(main.crawl(["Summoner 1", "Summoner 2", "Nobody"], max_depth=1, max_players=20, batch_size=5))
+
+		final = reports[-1]
+		self.assertTrue(final["done"])
+		self.assertEqual(final["not_found"], 1)
+		# Nothing to classify them from, but everyone else still gets crawled
+		self.assertGreaterEqual(final["failed"], 1)
+		self.assertIsNone(main.storage().find_player("Summoner 1"))
+		self.assertIsNotNone(main.storage().find_player("Summoner 2"))
+		self.assertGreater(final["processed"], 2)
+
+	def test_populate_streams_to_the_end(self):
+		client = main.app.test_client()
+		response = client.get("/api/debug/populate/Summoner 1,Summoner 4?depth=1&max=15&batch=5")
+		reports = [json.loads(line) for line in response.data.splitlines()]
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(reports[-1]["done"])
+		self.assertEqual(reports[-1]["processed"], 15)
+
+if __name__ == '__main__':
+	unittest.main()
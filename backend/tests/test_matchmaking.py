@@ -0,0 +1,74 @@
+"""
+Checks matchmaking in one process picks up teams other processes made or
+changed, with each process keeping its own index over shared storage.
+"""
+
+import unittest
+
+import main
+
+class SharedStorageTest(unittest.TestCase):
+	def setUp(self):
+		self.store = main.InMemoryStorage()
+		main.set_storage(self.store)
+		# Built when this process started, before anyone else did anything
+		main._matchmaking_index = main.MatchmakingIndex.from_storage(self.store)
+
+	def tearDown(self):
+		main.set_storage(None)
+		main._matchmaking_index = None
+
+	def other_process_team(self, leader, position):
+		"""A team made by another API process, so it's only in storage"""
+		team_id = self.store.create_team(self.store.add_player(leader, "GOLD", position), "GOLD")
+		self.store.commit()
+		return team_id
+
+	def request(self, name, position):
+		player_id = self.store.add_player(name, "GOLD", position)
+		return self.store.open_request(player_id)
+
+	def test_tick_matches_onto_team_from_another_process(self):
+		team_id = self.other_process_team("Leader", "TOP Fighter")
+		request_id = self.request("Joiner", "MID Mage")
+
+		stats = main.matchmaking_tick()
+		self.assertEqual(stats["matched"], 1)
+		self.assertEqual(self.store.open_team(team_id)[1], ["TOP Fighter", "MID Mage"])
+		self.assertEqual(self.store.pending_requests(), [])
+		self.assertEqual(main.matchmaking_index().size(team_id), 2)
+		self.assertIsNotNone(request_id)
+
+	def test_tick_forgets_teams_closed_elsewhere(self):
+		team_id = self.other_process_team("Leader", "TOP Fighter")
+		main.matchmaking_tick()
+		self.assertEqual(main.matchmaking_index().size(team_id), 1)
+
+		# Another process fills it up
+		for number, position in enumerate(["MID Mage", "JUNGLE Tank", "BOTTOM Marksman", "BOTTOM Support"]):
+			player_id = self.store.add_player("Other {0}".format(number), "GOLD", position)
+			self.assertEqual(self.store.claim_slots([(player_id, self.store.open_request(player_id), team_id, position)]), [True])
+		self.assertIsNone(self.store.open_team(team_id))
+
+		self.request("Joiner", "MID Mage")
+		stats = main.matchmaking_tick()
+		self.assertEqual(stats["matched"], 0)
+		self.assertEqual(len(main.matchmaking_index()), 0)
+
+	def test_sync_keeps_claims_in_progress(self):
+		team_id = self.other_process_team("Leader", "TOP Fighter")
+		index = main.matchmaking_index()
+		index.sync(self.store.open_teams())
+
+		# A joinateam in this process has taken a slot but not saved it yet
+		self.assertEqual(index.claim_slot("GOLD", "MID Mage"), team_id)
+		index.sync(self.store.open_teams())
+		self.assertEqual(index.size(team_id), 2)
+		self.assertIsNone(index.claim_slot("GOLD", "MID Mage"))
+
+		index.release_slot(team_id, "MID Mage")
+		index.sync(self.store.open_teams())
+		self.assertEqual(index.size(team_id), 1)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,44 @@
+"""
+Checks /api/metrics publishes how the Riot rate limit buckets are holding
+calls back.
+"""
+
+import unittest
+
+import main
+
+class RateLimitMetricsTest(unittest.TestCase):
+	def setUp(self):
+		self.saved = (main.metrics, main.rate_limiter)
+		main.metrics = main.Metrics(True)
+		main.rate_limiter = main.RateLimiter({"app": [(1, 0.05)], "match": [(5, 10)]})
+		self.client = main.app.test_client()
+
+	def tearDown(self):
+		main.metrics, main.rate_limiter = self.saved
+
+	def test_waits_and_rejections_are_counted(self):
+		# The second call has to wait for the app bucket to refill
+		main.rate_limiter.acquire("match")
+		main.rate_limiter.acquire("match")
+		main.rate_limiter.back_off("match", 0)
+
+		app, = main.rate_limiter.stats()["app"]
+		self.assertEqual(app["waits"], 1)
+		self.assertGreater(app["wait_ms"], 0)
+		self.assertEqual(app["rejections"], 1)
+		match, = main.rate_limiter.stats()["match"]
+		self.assertEqual(match["waits"], 0)
+		self.assertEqual(match["wait_ms"], 0)
+
+	def test_buckets_are_exported(self):
+		main.rate_limiter.back_off("match", 0)
+		lines = self.client.get("/api/metrics").data.splitlines()
+
+		self.assertIn('riot_rate_limit_rejections_total{bucket="match",window="10s"} 1', lines)
+		self.assertIn('riot_rate_limit_waits_total{bucket="app",window="0.05s"} 0', lines)
+		self.assertIn("# TYPE riot_rate_limit_wait_ms_total counter", lines)
+		self.assertIn('riot_rate_limit_queued{bucket="match",window="10s"} 0', lines)
+
+if __name__ == '__main__':
+	unittest.main()
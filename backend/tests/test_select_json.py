@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Checks select_json gives the same answer as decoding everything with
+json.loads and trimming it afterwards.
+"""
+
+import unittest
+import json
+
+import main
+
+def trimmed(value, shape):
+	"""What select_json should give back, worked out from the whole document"""
+	if isinstance(shape, dict) and isinstance(value, dict):
+		anything = shape.get("*")
+		return dict((key, trimmed(item, shape.get(key, anything))) for key, item in value.items() if shape.get(key, anything) is not None)
+	if isinstance(shape, frozenset) and isinstance(value, dict):
+		return dict((key, item) for key, item in value.items() if key in shape)
+	if isinstance(shape, list) and isinstance(value, list):
+		return [trimmed(item, shape[0]) for item in value]
+	return value
+
+class SelectJSONTest(unittest.TestCase):
+	def assertSelects(self, document, shape):
+		self.assertEqual(main.select_json(document, shape), trimmed(json.loads(document), shape))
+
+	def test_object_shapes(self):
+		document = '{"a": 1, "b": {"c": 2, "d": [1, 2]}, "e": "skipped", "f": {"g": 3, "h": 4}}'
+		self.assertSelects(document, {"a": True})
+		self.assertSelects(document, {"b": {"d": True}, "f": frozenset(("h",))})
+		self.assertSelects(document, {"missing": True})
+		self.assertSelects(document, True)
+
+	def test_lists(self):
+		self.assertSelects('[{"a": 1, "b": 2}, {"a": 3}, {}]', [frozenset(("a",))])
+		self.assertSelects('{"items": [{"a": {"b": 1, "c": 2}, "d": 3}]}', {"items": [{"a": frozenset(("c",))}]})
+		self.assertSelects('[]', [frozenset(("a",))])
+		# Shapes that don't fit what's there leave it alone
+		self.assertSelects('{"items": {"a": 1}}', {"items": [frozenset(("a",))]})
+		self.assertSelects('[1, 2]', {"a": True})
+
+	def test_any_key(self):
+		document = '{"version": "6.9.1", "data": {"Thresh": {"id": 412, "key": "Thresh", "lore": "..."}, "Ahri": {"id": 103, "lore": "..."}}}'
+		self.assertSelects(document, {"version": True, "data": {"*": frozenset(("id", "key"))}})
+		self.assertSelects(document, {"*": True})
+		# A named key takes priority over "*"
+		self.assertSelects(document, {"data": {"*": frozenset(("id",)), "Thresh": True}})
+		self.assertSelects('{"data": {}}', {"data": {"*": True}})
+
+	def test_string_escapes(self):
+		self.assertSelects(r'{"a\"b": "c\\d", "ef": "😀\n\t", "skip": "\"}"}', {"a\"b": True, u"ef": True})
+		self.assertSelects(r'{"data": {"kéy": {"v": "\/"}}}', {"data": {"*": frozenset(("v",))}})
+
+	def test_non_ascii(self):
+		document = u'{"naïve": "café", "ティーモ": {"n": "é"}, "skip": "ü"}'
+		shape = {u"naïve": True, u"ティーモ": True}
+		self.assertSelects(document, shape)
+		# Riot responses come in as UTF-8 bytes
+		self.assertSelects(document.encode("utf-8"), shape)
+		self.assertSelects(document.encode("utf-8"), {"*": True})
+
+	def test_whitespace_and_duplicates(self):
+		self.assertSelects(' \n{ "a" :\t1 ,\r\n "a" : 2 }\n ', {"a": True})
+		self.assertSelects('{ }', {"*": True})
+
+	def test_trailing_data(self):
+		for document in ('{"a": 1} x', '{"a": 1}{}', '[1] 2', '{"a": 1}}'):
+			self.assertRaises(ValueError, json.loads, document)
+			self.assertRaises(ValueError, main.select_json, document, {"a": True})
+
+	def test_malformed(self):
+		documents = [
+			'', '   ', '{', '{"a"', '{"a": ', '{"a": 1', '{"a" 1}', '{"a": 1 "b": 2}', '{a: 1}', '{"a": 1,}',
+			'{"skip": [1,, 2], "a": 1}', '{"skip": tru, "a": 1}', '{"a": "unterminated}', '{"a": "\\x"}'
+		]
+		for document in documents:
+			self.assertRaises(ValueError, json.loads, document)
+			for shape in ({"a": True}, {"*": True}, [True], True):
+				self.assertRaises(ValueError, main.select_json, document, shape)
+
+	def test_champion_data(self):
+		with open(main.champions_file) as f:
+			document = f.read()
+		self.assertSelects(document, main.champion_data_shape)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,88 @@
+"""
+Checks both storage backends close a request onto exactly one team, however
+many claims race for it, and that the SQLite pool doesn't wait forever.
+"""
+
+import unittest
+import tempfile
+import os
+
+import main
+
+class ClaimTest(object):
+	"""Shared by the tests for each backend, which set up self.store"""
+	def add_team(self, leader_name):
+		leader_id = self.store.add_player(leader_name, "GOLD", "TOP Fighter")
+		return self.store.create_team(leader_id, "GOLD")
+
+	def test_request_claimed_onto_one_team(self):
+		first = self.add_team("Leader One")
+		second = self.add_team("Leader Two")
+		player_id = self.store.add_player("Joiner", "GOLD", "MID Mage")
+		request_id = self.store.open_request(player_id)
+		self.store.commit()
+
+		# Say the tick and a joinateam both picked it up from the same snapshot
+		self.assertEqual(self.store.claim_slots([(player_id, request_id, first, "MID Mage")]), [True])
+		self.assertEqual(self.store.claim_slots([(player_id, request_id, second, "MID Mage")]), [None])
+		self.store.commit()
+
+		self.assertEqual(self.store.open_team(first)[1], ["TOP Fighter", "MID Mage"])
+		self.assertEqual(self.store.open_team(second)[1], ["TOP Fighter"])
+		self.assertEqual(self.store.pending_requests(), [])
+
+	def test_request_in_one_batch_twice(self):
+		first = self.add_team("Leader One")
+		second = self.add_team("Leader Two")
+		player_id = self.store.add_player("Joiner", "GOLD", "MID Mage")
+		request_id = self.store.open_request(player_id)
+		results = self.store.claim_slots([(player_id, request_id, first, "MID Mage"), (player_id, request_id, second, "MID Mage")])
+		self.assertEqual(results, [True, None])
+
+	def test_failed_team_claim_leaves_request_open(self):
+		team_id = self.add_team("Leader")
+		player_id = self.store.add_player("Joiner", "GOLD", "TOP Fighter")
+		request_id = self.store.open_request(player_id)
+		# The leader already plays that position
+		self.assertEqual(self.store.claim_slots([(player_id, request_id, team_id, "TOP Fighter")]), [False])
+		self.assertEqual([row["req_id"] for row in self.store.pending_requests()], [request_id])
+
+class InMemoryClaimTest(ClaimTest, unittest.TestCase):
+	def setUp(self):
+		self.store = main.InMemoryStorage()
+
+class SQLiteClaimTest(ClaimTest, unittest.TestCase):
+	def setUp(self):
+		handle, self.path = tempfile.mkstemp(suffix=".db")
+		os.close(handle)
+		main.database_url = self.path
+		main.init_db()
+		self.context = main.app.app_context()
+		self.context.push()
+		self.store = main.SQLiteStorage()
+
+	def tearDown(self):
+		self.store.rollback()
+		self.context.pop()
+		os.remove(self.path)
+
+class ConnectionPoolTest(unittest.TestCase):
+	def setUp(self):
+		handle, self.path = tempfile.mkstemp(suffix=".db")
+		os.close(handle)
+		self.pool = main.ConnectionPool(self.path, 1, timeout=0.05)
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def test_waiting_too_long_fails(self):
+		held = self.pool.acquire()
+		self.assertRaises(main.sqlite3.OperationalError, self.pool.acquire)
+		self.assertEqual(self.pool.stats()["timeouts"], 1)
+
+		# Once it's back the next request gets it
+		self.pool.release(held)
+		self.assertIs(self.pool.acquire(), held)
+
+if __name__ == '__main__':
+	unittest.main()